@@ -1,6 +1,7 @@
 # Import necessary libraries
 import sqlite3
 import pandas as pd
+import numpy as np
 import base64
 import re
 import ee
@@ -24,8 +25,40 @@ from branca.element import MacroElement
 from jinja2 import Template
 from PIL import Image, ExifTags
 from PIL.ExifTags import TAGS, GPSTAGS
+import shutil
 import subprocess
 import urllib.request
+import argparse
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import threading
+import time
+
+# Optional: inotify-based file watching for --watch, polling is used otherwise
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Optional: Arrow-backed strings for the tree codes and GeoParquet exports, Python strings otherwise
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    CODE_DTYPE = "string[pyarrow]"
+except ImportError:
+    pa = pc = pq = None
+    CODE_DTYPE = "string"
+
+# Optional: FlatGeobuf exports, skipped otherwise
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
 
 print("📚 1. Libraries imported successfully.")
 
@@ -39,14 +72,140 @@ output_geojson = "geotagged_tree.geojson"
 output_kml = "geotagged_tree.kml"
 output_geojson_pijak = "pijak_tree.geojson"
 output_kml_pijak = "pijak_tree.kml"
+output_map = "tree_map.html"
+output_reconciliation = "reconciliation_report.csv"
+output_parquet = "geotagged_tree.parquet"
+output_parquet_pijak = "pijak_tree.parquet"
+output_fgb = "geotagged_tree.fgb"
+output_fgb_pijak = "pijak_tree.fgb"
 
 # Folder with .db files
 db_folder = './db'
-csv_files = []
 pictures_folder = "pictures"
 pijak_pictures_folder = "pijak_foto"
 image_markers = folium.FeatureGroup(name="Photos EXIF", show=False)
 
+# Google Sheets
+SERVICE_ACCOUNT_FILE = "credentials.json"
+SHEET_NAME = "Mangrove Database"
+WORKSHEET_NAME = "TreeStatus"
+
+# Site configuration, every key can be overridden per site in a --sites JSON file.
+# Folders and outputs are relative to the site root, where the map is saved.
+DEFAULT_SITE = {
+    "name": "manengkel",
+    "root": ".",
+    "ee_project": "manengkel-solidaritas",
+    "sentinel_point": [1.1895299, 124.5123245],
+    "sentinel_dates": ["2024-07-01", "2024-07-31"],
+    "sheet_name": SHEET_NAME,
+    "worksheet_name": WORKSHEET_NAME,
+    "target_trees": 4103,
+    "thumbnails": isThumbnailsEnabled,
+    "db_folder": db_folder,
+    "pictures_folder": pictures_folder,
+    "pijak_pictures_folder": pijak_pictures_folder,
+    "output_csv": output_csv,
+    "output_geojson": output_geojson,
+    "output_kml": output_kml,
+    "output_geojson_pijak": output_geojson_pijak,
+    "output_kml_pijak": output_kml_pijak,
+    "output_map": output_map,
+    "output_reconciliation": output_reconciliation,
+    "output_parquet": output_parquet,
+    "output_parquet_pijak": output_parquet_pijak,
+    "output_fgb": output_fgb,
+    "output_fgb_pijak": output_fgb_pijak,
+    # Load trees and photos by viewport from tile chunks, the map then has to be served over HTTP
+    "viewport_loading": False,
+    "tiles_folder": "tree_tiles",
+    # NDVI sampled at each tree, cached by image parameters, code and coordinates
+    "ndvi_cache": "ndvi_cache.json",
+    # Photo stores: content hashes, EXIF GPS and perceptual hashes of the photos, and Pijak photo URLs
+    "pictures_index": "pictures_index.json",
+    "pijak_pictures_index": "pijak_foto_index.json",
+    "perceptual_hash": True,
+}
+
+# Watch mode
+# Inputs that can change between rebuilds, and the outputs depending on each of them
+SOURCES = ("db", "status", "pijak", "pictures", "pijak_foto")
+OUTPUT_DEPENDENCIES = {
+    "csv": {"db", "status"},
+    "map": {"db", "status", "pijak", "pictures", "pijak_foto"},
+    "combined": {"db", "status", "pijak", "pictures"},
+    "pijak": {"pijak", "pictures"},
+    "reconciliation": {"db", "status", "pijak"},
+}
+watch_debounce_seconds = 2.0
+watch_tick_seconds = 1.0
+sheet_poll_seconds = 60.0
+# Sources of a failed rebuild are rebuilt again after this delay, or earlier with the next changes
+watch_retry_seconds = 30.0
+# Trees whose DB and Pijak positions differ by more than this are flagged as moved
+reconcile_moved_m = 3.0
+# Photos taken further than this from every tree are not attached to any tree
+photo_match_distance_m = 5.0
+# Viewport loading: aggregated counts from lod_min_zoom, individual trees from lod_detail_zoom,
+# each aggregated chunk is split in 2^lod_cluster_depth x 2^lod_cluster_depth cells
+lod_min_zoom = 12
+lod_detail_zoom = 17
+lod_cluster_depth = 3
+# Stage scheduler: threads running the independent network and disk stages of a build
+stage_workers = 8
+stage_timeout_seconds = 300.0
+download_workers = 8
+download_timeout_seconds = 60.0
+# Batch builds: sites built concurrently, they are I/O-bound and share one set of clients
+site_workers = 4
+# NDVI sampling: trees per reduceRegions call (getInfo returns at most 5000 features) and scale in meters
+ndvi_batch_size = 5000
+ndvi_scale = 10
+# Earth Engine map ids expire, request new tile URLs after this delay
+ee_tiles_max_age_seconds = 6 * 3600
+# Photo stores: files read for EXIF, files per exiftool call, and the perceptual hash
+# distance in bits (out of 64) under which two photos are reported as near duplicates
+photo_extensions = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".tif", ".tiff", ".webp")
+exiftool_batch_size = 500
+phash_max_distance = 6
+# GeoParquet exports: rows sorted along a Z-order curve of the zoom 24 tiles (~2 m) and
+# written in row groups of this size, each one with its own bbox statistics
+export_sort_zoom = 24
+export_row_group_size = 1024
+# Query API: default address, page sizes and largest nearest-tree radius in meters
+serve_host = "127.0.0.1"
+serve_port = 8765
+serve_page_size = 100
+serve_max_page_size = 1000
+serve_nearest_max_m = 100.0
+
+# Compact dtypes assigned at ingestion. Coordinates stay float64, float32 would
+# round them to about 1 m while trees are planted about 1 m apart.
+DB_SCHEMA = {
+    "tree_id": "int",
+    "code": CODE_DTYPE,
+    "tree_name": "category",
+    "binomialName": "category",
+    "tree_status": "category",
+    "programName": "category",
+    "treeMonitoringId": "int",
+    "monitoring_elevation": "float32",
+    "ndvi": "float32",
+    "statusApproval": "category",
+    "status": "category",
+    "border_color": "category",
+    "fill_color": "category",
+}
+PIJAK_SCHEMA = {
+    "Kode": CODE_DTYPE,
+    "Nama pohon": "category",
+    "Status": "category",
+    "Tree Status": "category",
+    "border_color": "category",
+    "fill_color": "category",
+    "ndvi": "float32",
+}
+
 print("🔧 2. Variables initialized.")
 
 # SQL Query
@@ -100,6 +259,13 @@ def remap_kode(k):
 
 print("🔁 6. remap_kode function defined.")
 
+def canonical_code(codes):
+    """Vectorized remap_kode: upper-cased, trimmed codes with MAN-n turned into JJK-nnn."""
+    codes = codes.astype(str).str.strip().str.upper()
+    numbers = codes.str.extract(r"^MAN-(\d+)", expand=False)
+    remapped = "JJK-" + numbers.dropna().astype(int).astype(str).str.zfill(3)
+    return codes.where(numbers.isna(), remapped)
+
 def dms_to_decimal(dms_str):
     if not isinstance(dms_str, str):
         raise ValueError(f"Invalid DMS coordinate: {dms_str}")
@@ -117,14 +283,108 @@ def dms_to_decimal(dms_str):
 
 print("📏 7. dms_to_decimal function defined.")
 
-def extract_gps_from_images(folder="pictures"):
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_M * np.pi / 180
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in meters between arrays of coordinates."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+class GridIndex:
+    """Uniform grid over point coordinates for nearest-point queries within a radius.
+
+    Cells are at least `cell_m` meters wide, so every point closer than `cell_m`
+    to a query lies in the 3x3 block of cells around it.
+    """
+
+    def __init__(self, lats, lons, cell_m):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        self.ids = np.flatnonzero(valid)
+        self.lats = lats[valid]
+        self.lons = lons[valid]
+        self.cell_lat = max(cell_m, 1.0) / METERS_PER_DEGREE
+        max_abs_lat = np.abs(self.lats).max() if len(self.lats) else 0.0
+        self.cell_lon = self.cell_lat / max(np.cos(np.radians(min(max_abs_lat, 89.0))), 1e-6)
+        keys = self._keys(*self._cells(self.lats, self.lons))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _cells(self, lats, lons):
+        return np.floor(lons / self.cell_lon).astype(np.int64), np.floor(lats / self.cell_lat).astype(np.int64)
+
+    @staticmethod
+    def _keys(ix, iy):
+        return ix * (1 << 31) + (iy + (1 << 30))
+
+    def nearest(self, lats, lons, max_m):
+        """Return (index, distance) of the nearest point for each query, index is -1 beyond `max_m`."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        best_d = np.full(len(lats), np.inf)
+        best_i = np.full(len(lats), -1, dtype=np.int64)
+        queryable = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+        if not len(self.sorted_keys) or not len(queryable):
+            return best_i, best_d
+        qlats, qlons = lats[queryable], lons[queryable]
+        ix, iy = self._cells(qlats, qlons)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self._keys(ix + dx, iy + dy)
+                start = np.searchsorted(self.sorted_keys, keys, side="left")
+                counts = np.searchsorted(self.sorted_keys, keys, side="right") - start
+                total = counts.sum()
+                if not total:
+                    continue
+                # Expand every query into (query, candidate) pairs without a Python loop
+                query_idx = np.repeat(np.arange(len(queryable)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                point_idx = self.order[np.repeat(start, counts) + offsets]
+                d = haversine_m(qlats[query_idx], qlons[query_idx], self.lats[point_idx], self.lons[point_idx])
+                # Keep the closest candidate of each query
+                sel = np.lexsort((d, query_idx))
+                query_idx, point_idx, d = query_idx[sel], point_idx[sel], d[sel]
+                first = np.r_[True, query_idx[1:] != query_idx[:-1]]
+                query_idx, point_idx, d = query_idx[first], point_idx[first], d[first]
+                better = d < best_d[queryable[query_idx]]
+                best_d[queryable[query_idx[better]]] = d[better]
+                best_i[queryable[query_idx[better]]] = self.ids[point_idx[better]]
+        best_i[best_d > max_m] = -1
+        return best_i, best_d
+
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Return the sorted indexes of the points inside the bounding box."""
+        if not len(self.sorted_keys):
+            return np.empty(0, dtype=np.int64)
+        # Boxes reaching past the poles or the antimeridian would overflow the cell numbers
+        min_lat, max_lat = np.clip([min_lat, max_lat], -90.0, 90.0)
+        min_lon, max_lon = np.clip([min_lon, max_lon], -180.0, 180.0)
+        (ix0, ix1), (iy0, iy1) = self._cells(np.array([min_lat, max_lat]), np.array([min_lon, max_lon]))
+        columns = np.arange(ix0, ix1 + 1)
+        if len(columns) > len(self.sorted_keys):
+            # Wider than the data, a scan is cheaper than one lookup per column
+            candidates = np.arange(len(self.lats))
+        else:
+            # The cells of a column have consecutive keys, one key range per column
+            start = np.searchsorted(self.sorted_keys, self._keys(columns, iy0), side="left")
+            counts = np.searchsorted(self.sorted_keys, self._keys(columns, iy1), side="right") - start
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            candidates = self.order[np.repeat(start, counts) + offsets]
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        return np.sort(self.ids[candidates[inside]])
+
+def extract_gps_from_images(folder="pictures", paths=None):
     cmd = [
         "exiftool",
         "-gpslatitude",
         "-gpslongitude",
         "-filename",
         "-json",
-        folder
+        *(paths or [folder])
     ]
     result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     if result.returncode != 0:
@@ -144,26 +404,256 @@ def extract_gps_from_images(folder="pictures"):
 
 print("📸 8. extract_gps_from_images function defined.")
 
-def add_image_markers(map_object, image_points, group_name="Photos"):
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def perceptual_hash(path):
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale version of the image."""
+    with Image.open(path) as img:
+        # JPEG images are decoded straight at a reduced size
+        img.draft("L", (64, 64))
+        pixels = np.asarray(img.convert("L").resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+def near_duplicates(phashes, max_distance=phash_max_distance):
+    """Pairs of images whose perceptual hashes differ by at most `max_distance` bits.
+
+    Two such hashes are equal on at least one of `max_distance` + 1 disjoint bit bands,
+    so only the images sharing a band value are compared.
+    """
+    names = list(phashes)
+    if len(names) < 2:
+        return []
+    values = np.array([int(phashes[name], 16) for name in names], dtype=np.uint64)
+    width = 64 // (max_distance + 1)
+    candidates = []
+    for band in range(max_distance + 1):
+        bits = width if band < max_distance else 64 - band * width
+        keys = pd.DataFrame({
+            "key": (values >> np.uint64(band * width)) & np.uint64((1 << bits) - 1),
+            "i": np.arange(len(values))
+        })
+        pairs = keys.merge(keys, on="key")
+        candidates.append(pairs.loc[pairs["i_x"] < pairs["i_y"], ["i_x", "i_y"]])
+    pairs = pd.concat(candidates).drop_duplicates()
+    first, second = pairs["i_x"].to_numpy(), pairs["i_y"].to_numpy()
+    xor = (values[first] ^ values[second]).view(np.uint8).reshape(-1, 8)
+    distances = np.unpackbits(xor, axis=1).sum(axis=1)
+    close = distances <= max_distance
+    return sorted((names[i], names[j], int(d)) for i, j, d in zip(first[close], second[close], distances[close]))
+
+class PhotoStore:
+    """Photos of a folder indexed by the SHA-256 of their content.
+
+    The index saved at `index_path` keeps the hash of each file (read again only when its
+    mtime or size changes), the EXIF GPS and perceptual hash of each distinct image and,
+    for downloaded photos, the URL of each file. Downloads, EXIF parsing and hashing then
+    run once per distinct image, whatever its file name or URL.
+    """
+
+    def __init__(self, folder, index_path, perceptual=True):
+        self.folder = folder
+        self.index_path = index_path
+        self.perceptual = perceptual
+        self.lock = threading.Lock()
+        self.changed = False
+        index = {}
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except ValueError as e:
+                print(f"⚠️ Photo index {index_path} unreadable, rebuilding it: {e}")
+        # file name -> {"stat": [mtime, size], "sha256": ...}
+        self.files = index.get("files", {})
+        # sha256 -> {"gps": [lat, lon] or None, "phash": ...}
+        self.images = index.get("images", {})
+        # url -> file name
+        self.urls = index.get("urls", {})
+        self.duplicates = index.get("near_duplicates", [])
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def lookup(self, url):
+        """Name of the stored photo downloaded from `url`, None when it was never downloaded."""
+        name = self.urls.get(url)
+        return name if name and os.path.isfile(self.path(name)) else None
+
+    def register(self, name, digest):
+        stat = os.stat(self.path(name))
+        with self.lock:
+            self.files[name] = {"stat": [stat.st_mtime_ns, stat.st_size], "sha256": digest}
+            self.images.setdefault(digest, {})
+            self.changed = True
+
+    def hash_file(self, name):
+        stat = os.stat(self.path(name))
+        entry = self.files.get(name)
+        if entry and entry["stat"] == [stat.st_mtime_ns, stat.st_size]:
+            return entry["sha256"]
+        digest = file_sha256(self.path(name))
+        self.register(name, digest)
+        return digest
+
+    def add(self, path, url=None, suffix=".jpg"):
+        """Move the file at `path` in the store, named by its content hash, and return its name.
+
+        When the same image is already stored, the new copy is deleted instead.
+        """
+        digest = file_sha256(path)
+        name = digest + suffix.lower()
+        if os.path.isfile(self.path(name)):
+            os.remove(path)
+        else:
+            os.replace(path, self.path(name))
+        self.register(name, digest)
+        if url:
+            with self.lock:
+                self.urls[url] = name
+        return name
+
+    def describe(self, names, gps=True):
+        """Read the EXIF GPS and perceptual hash of the images not described yet, `names` maps sha256 -> file."""
+        todo = {digest: name for digest, name in names.items()
+                if (gps and "gps" not in self.images[digest]) or (self.perceptual and "phash" not in self.images[digest])}
+        if not todo:
+            return
+        if gps:
+            files = list(todo.values())
+            found = {}
+            for start in range(0, len(files), exiftool_batch_size):
+                batch = [self.path(name) for name in files[start:start + exiftool_batch_size]]
+                found.update({name: [lat, lon] for lat, lon, name in extract_gps_from_images(self.folder, batch)})
+        for digest, name in todo.items():
+            image = self.images[digest]
+            if gps:
+                image["gps"] = found.get(name)
+            if self.perceptual and "phash" not in image:
+                try:
+                    image["phash"] = perceptual_hash(self.path(name))
+                except Exception as e:
+                    image["phash"] = None
+                    print(f"⚠️ Could not hash {name}: {e}")
+        self.changed = True
+        print(f"🧬 {len(todo)} new images described in {self.folder}.")
+
+    def find_near_duplicates(self, names):
+        """Report the stored images that look alike, `names` maps sha256 -> file."""
+        if not self.perceptual:
+            return
+        phashes = {name: self.images[digest]["phash"] for digest, name in names.items()
+                   if self.images[digest].get("phash")}
+        duplicates = [list(pair) for pair in near_duplicates(phashes)]
+        if duplicates != self.duplicates:
+            self.duplicates = duplicates
+            self.changed = True
+        if duplicates:
+            print(f"🧬 {len(duplicates)} near-duplicate photo pairs in {self.folder}, listed in {self.index_path}.")
+
+    def image_points(self):
+        """(lat, lon, file) of the geotagged photos of the folder, one per distinct image."""
+        names = sorted(entry.name for entry in os.scandir(self.folder)
+                       if entry.is_file() and entry.name.lower().endswith(photo_extensions)) \
+            if os.path.isdir(self.folder) else []
+        distinct = {}
+        for name in names:
+            distinct.setdefault(self.hash_file(name), name)
+        for name in set(self.files) - set(names):
+            del self.files[name]
+            self.changed = True
+        self.describe(distinct)
+        self.find_near_duplicates(distinct)
+        self.save()
+        if len(distinct) < len(names):
+            print(f"🧬 {len(names) - len(distinct)} duplicate photos in {self.folder} are only shown once.")
+        return [(*self.images[digest]["gps"], name) for digest, name in distinct.items() if self.images[digest].get("gps")]
+
+    def save(self):
+        """Write the index when something changed, so watch mode does not loop on its own writes."""
+        with self.lock:
+            if not self.changed:
+                return
+            index = {"files": self.files, "images": self.images, "urls": self.urls, "near_duplicates": self.duplicates}
+            with open(self.index_path + ".part", "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(self.index_path + ".part", self.index_path)
+            self.changed = False
+
+def photo_store(site, folder_key, index_key):
+    return PhotoStore(site_path(site, folder_key), site_path(site, index_key), site["perceptual_hash"])
+
+def photo_suffix(url):
+    suffix = os.path.splitext(urlsplit(url).path)[1].lower()
+    return suffix if suffix in photo_extensions else ".jpg"
+
+def attach_photos_to_trees(image_points, codes, lats, lons, max_distance_m=photo_match_distance_m):
+    """Map each tree code to the photos whose nearest tree it is, within `max_distance_m`."""
+    if not image_points or not len(codes):
+        return {}
+    photo_lats, photo_lons, files = zip(*image_points)
+    index = GridIndex(lats, lons, max_distance_m)
+    tree_idx, _ = index.nearest(photo_lats, photo_lons, max_distance_m)
+    matched = tree_idx >= 0
+    photos = pd.DataFrame({
+        "code": np.asarray(codes, dtype=object)[tree_idx[matched]],
+        "file": np.asarray(files, dtype=object)[matched]
+    })
+    print(f"📎 {matched.sum()}/{len(files)} photos attached to {photos['code'].nunique()} trees.")
+    return photos.groupby("code")["file"].agg(list).to_dict()
+
+def tree_photos_html(files, site=DEFAULT_SITE):
+    html = "<br><b>Photos:</b>"
+    for file_path in files:
+        if site["thumbnails"]:
+            img_path = site["pictures_folder"] + '/thumbnails/tn_' + file_path
+        else:
+            img_path = site["pictures_folder"] + '/' + file_path
+        html += f"""
+        <br><a href="{site['pictures_folder'] + '/' + file_path}" target="_blank">
+            <img data-src="{img_path}"
+                 src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
+                 width="150"
+                 class="lazy-image"
+            >
+        </a>
+        """
+    return html
+
+def image_popup_html(file_path, photo_codes, site=DEFAULT_SITE):
+    if site["thumbnails"]:
+        img_path = site["pictures_folder"] + '/thumbnails/tn_' + file_path
+    else:
+        img_path = site["pictures_folder"] + '/' + file_path
+    full_res_img_path = site["pictures_folder"] + '/' + file_path
+    if not os.path.exists(os.path.join(site["root"], img_path)) and not site["thumbnails"]:
+        print(f"⚠️ File not found: {img_path}")
+        return None
+    popup_html = f'''
+    <a href="{full_res_img_path}" target="_blank">
+        <img data-src="{img_path}"
+            src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
+            style="max-width:600px; max-height:400px; display:block;"
+            class="lazy-image">
+    </a>
+    '''
+    if file_path in photo_codes:
+        popup_html += f"<b>Tree:</b> {photo_codes[file_path]}"
+    return popup_html
+
+def add_image_markers(map_object, image_points, group_name="Photos", photo_codes=None, site=DEFAULT_SITE):
     feature_group = folium.FeatureGroup(name=group_name, show=False)
+    photo_codes = photo_codes or {}
     for lat, lon, file_path in image_points:
         try:
-            if isThumbnailsEnabled:
-                img_path = 'pictures/thumbnails/tn_' + file_path
-            else:
-                img_path = pictures_folder + '/' + file_path
-            full_res_img_path = pictures_folder + '/' + file_path
-            if not os.path.exists(img_path) and not isThumbnailsEnabled:
-                print(f"⚠️ File not found: {img_path}")
+            popup_html = image_popup_html(file_path, photo_codes, site)
+            if popup_html is None:
                 continue
-            popup_html = f'''
-            <a href="{full_res_img_path}" target="_blank">
-                <img data-src="{img_path}"
-                    src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
-                    style="max-width:600px; max-height:400px; display:block;"
-                    class="lazy-image">
-            </a>
-            '''
             popup = folium.Popup(popup_html, max_width='auto')
             folium.Marker(
                 location=[lat, lon],
@@ -171,7 +661,7 @@ def add_image_markers(map_object, image_points, group_name="Photos"):
                 icon=folium.Icon(color="blue", icon="camera", prefix="fa")
             ).add_to(feature_group)
         except Exception as e:
-            print(f"❌ Could not load image {img_path}: {e}")
+            print(f"❌ Could not load image {file_path}: {e}")
 
     feature_group.add_to(map_object)
 
@@ -185,316 +675,54 @@ def get_pijak_colors(status):
 
 print("🎨 10. get_pijak_colors function defined.")
 
-# Process each .db file
-db_paths = glob(os.path.join(db_folder, "*.db"))
-if not db_paths:
-    print("❌ No .db files found.")
-    exit(1)
-
-for idx, db_path in enumerate(db_paths, start=1):
-    db_name = os.path.splitext(os.path.basename(db_path))[0]
-    out_csv = f"geotagged_tree_{db_name}.csv"
-    try:
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        df = df[df['statusApproval'] != 'NeedAction']
-        df.to_csv(out_csv, index=False)
-        csv_files.append(out_csv)
-        print(f"📁 {idx}. Processed {db_path} and saved to {out_csv}.")
-    except Exception as e:
-        print(f"❌ Error with {db_path}: {e}")
-
-if not csv_files:
-    print("⚠️ No CSVs generated.")
-    exit(1)
-
-# Aggregate data from all CSV files
-df_all = pd.concat([pd.read_csv(f) for f in csv_files])
-df_all['monitoring_date'] = pd.to_datetime(df_all['monitoring_date'], errors='coerce')
-df_all['code'] = df_all['code'].str.replace(r'^MAN-(\d{1})$', r'MAN-00\1', regex=True)
-df_all['code'] = df_all['code'].str.replace(r'^MAN-(\d{2})$', r'MAN-0\1', regex=True)
-df_all['code'] = df_all['code'].str.replace(r'^MAN', 'JJK', regex=True)
-df_latest = df_all.sort_values('monitoring_date').dropna(subset=['code']).drop_duplicates('code', keep='last')
-
-print("📊 11. Data aggregated from all CSV files.")
-
-# Google Sheets integration
-SERVICE_ACCOUNT_FILE = "credentials.json"
-SHEET_NAME = "Mangrove Database"
-WORKSHEET_NAME = "TreeStatus"
-creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=[
-    "https://www.googleapis.com/auth/spreadsheets.readonly",
-    "https://www.googleapis.com/auth/drive.readonly"
-])
-gc = gspread.authorize(creds)
-ws = gc.open(SHEET_NAME).worksheet(WORKSHEET_NAME)
-data = ws.get_all_values()
-df_status = pd.DataFrame(data[1:], columns=data[0]).iloc[:, :2]
-df_status.columns = ['code', 'status']
-
-print("📚 12. Data fetched from Google Sheets.")
-
-# Merge status data
-df_latest = df_latest.merge(df_status, on="code", how="left")
-df_latest["status"] = df_latest["status"].fillna("Unknown")
-df_latest[["border_color", "fill_color"]] = df_latest["status"].apply(lambda s: pd.Series(get_color_tuple(s)))
-df_latest.to_csv(output_csv, index=False)
-
-print("🔗 13. Status data merged and saved to CSV.")
-
-# Load Pijak DB
-df_pijak = pd.DataFrame(gc.open(SHEET_NAME).worksheet("Pijak DB").get_all_records())
-df_pijak = df_pijak[df_pijak['Status'].str.lower().str.strip().str.contains("geotag")]
-df_pijak['Latitude'] = pd.to_numeric(df_pijak['Latitude'], errors='coerce')
-df_pijak['Longitude'] = pd.to_numeric(df_pijak['Longitude'], errors='coerce')
-df_pijak = df_pijak.dropna(subset=['Latitude', 'Longitude'])
-df_pijak['Kode'] = df_pijak['Kode'].apply(remap_kode)
-df_pijak[["border_color", "fill_color"]] = df_pijak["Tree Status"].apply(lambda s: pd.Series(get_pijak_colors(s)))
-
-print("📚 14. Pijak DB loaded and processed.")
-
-# Create map
-center_lat = df_latest["latitude"].mean()
-center_lon = df_latest["longitude"].mean()
-m = folium.Map(location=[center_lat, center_lon], zoom_start=19, control_scale=True, tiles="OpenStreetMap")
-
-print("🌍 15. Map initialized.")
-
-# Add favicon, title, and meta viewport
-favicon = Element('''
-<link rel="icon" href="favicon.ico" type="image/x-icon">
-''')
-m.get_root().html.add_child(favicon)
-
-title = Element('''
-<title>🌱 Mangrove Project</title>
-''')
-m.get_root().html.add_child(title)
-
-meta_viewport = Element('''
-<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-''')
-m.get_root().html.add_child(meta_viewport)
-
-print("📌 16. Favicon, title, and meta viewport added to map.")
-
-# Add Google Earth Engine Layer
-ee.Authenticate()
-ee.Initialize(project='manengkel-solidaritas')
-lat, lon = 1.1895299, 124.5123245
-point = ee.Geometry.Point([lon, lat])
-sentinel = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
-    .filterBounds(point) \
-    .filterDate('2024-07-01', '2024-07-31') \
-    .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10)) \
-    .median()
-rgb = sentinel.visualize(
-    bands=['B4', 'B3', 'B2'],
-    min=0,
-    max=3000
-).reproject(crs='EPSG:4326', scale=10)
-rgb_mapid = ee.data.getMapId({'image': rgb})
-folium.TileLayer(
-    tiles=rgb_mapid['tile_fetcher'].url_format,
-    attr='Sentinel-2 10m',
-    name='Sentinel-2 10m (low res)',
-    overlay=False,
-    control=True
-).add_to(m)
-
-print("🛰️ 17. Google Earth Engine Layer added to map.")
-
-# Add NDVI Layer
-ndvi = sentinel.normalizedDifference(['B8', 'B4']).rename('NDVI')
-ndvi_vis = ndvi.visualize(min=0.0, max=1.0, palette=['blue', 'white', 'green'])
-ndvi_tiles = ee.data.getMapId({'image': ndvi_vis})['tile_fetcher'].url_format
-folium.TileLayer(
-    tiles=ndvi_tiles,
-    attr='NDVI',
-    name='🌿 Sentinel NDVI (low res)',
-    overlay=False,
-    control=True
-).add_to(m)
-
-print("🌿 18. NDVI Layer added to map.")
-
-# Add ESRI Layer
-m.add_child(AssignMapToWindow())
-folium.TileLayer(
-    name="Satellite (ESRI)",
-    tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-    attr="Tiles © Esri"
-).add_to(m)
-Fullscreen(position="topright").add_to(m)
-
-print("🌐 19. ESRI Layer added to map.")
-
-# Add Google Maps Layer
-folium.TileLayer(
-    name="Satellite (Google)",
-    tiles="http://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}",
-    attr="Google Satellite",
-    max_zoom=21,
-    min_zoom=0,
-    overlay=False,
-    control=True
-).add_to(m)
-
-print("🗺️ 20. Google Maps Layer added to map.")
-
-# Add markers for trees
-tree_layer = folium.FeatureGroup(name="Previous DB", show=False)
-marker_dict = {}
-for _, row in df_latest.iterrows():
-    coord = (row["latitude"], row["longitude"])
-    marker = folium.CircleMarker(
-        location=coord,
-        radius=5,
-        color=row["border_color"],
-        fill=True,
-        fill_color=row["fill_color"],
-        fill_opacity=0.9,
-        weight=1,
-        popup=folium.Popup(
-            f"<b>ID:</b> {row['tree_id']}<br>"
-            f"<b>Code:</b> {row['code']}<br>"
-            f"<b>Status:</b> {row['status']}",
-            max_width=250
-        ),
-        tooltip=row["code"]
-    )
-    marker.add_to(tree_layer)
-    marker_dict[row['code']] = marker
-tree_layer.add_to(m)
-
-print("🌳 21. Tree markers added to map.")
-
-# Add markers for Pijak DB
-pijak_layer = folium.FeatureGroup(name="Current DB")
-missing_images = []
-for _, row in df_pijak.iterrows():
-    html = f"<b>Kode:</b> {row['Kode']}<br><b>Status:</b> {row['Tree Status']}"
-    foto_path = row.get("Foto 1")
-    img_tag = "<br><em>Picture not available</em>"
-    if foto_path:
-        local_filename = os.path.basename(foto_path)
-        local_path = os.path.join(pijak_pictures_folder, local_filename)
-
-        if not os.path.isfile(local_path):
-            try:
-                print(f"⬇️ Downloading missing image for {row['Kode']} from {foto_path}...")
-                urllib.request.urlretrieve(foto_path, local_path)
-                print(f"✅ Image saved to {local_path}")
-            except Exception as e:
-                print(f"❌ Failed to download image for {row['Kode']}: {e}")
-
-        if isThumbnailsEnabled:
-            thumbnail_path = f"pijak_foto/thumbnails/tn_{local_filename}"
-        else:
-            thumbnail_path = local_path
-
-        if os.path.isfile(local_path):
-            img_tag = f"""
-            <br><a href="{foto_path}" target="_blank">
-                <img data-src="{thumbnail_path}"
-                     src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
-                     width="150"
-                     class="lazy-image"
-                >
-            </a>
-            """
+def status_colors(statuses, get_colors):
+    """Border and fill colors of every status, get_colors is called once per distinct status."""
+    colors = {status: get_colors(status) for status in statuses.unique()}
+    return pd.DataFrame({
+        "border_color": statuses.map({status: c[0] for status, c in colors.items()}),
+        "fill_color": statuses.map({status: c[1] for status, c in colors.items()})
+    }, index=statuses.index)
+
+def apply_schema(df, schema):
+    """Return `df` with the columns listed in `schema` cast to compact dtypes.
+
+    "int" downcasts integer columns to the smallest integer type holding their values,
+    columns with another dtype (e.g. text identifiers) are left untouched.
+    """
+    dtypes = {}
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == "int":
+            if pd.api.types.is_integer_dtype(df[column]):
+                dtypes[column] = pd.to_numeric(df[column], downcast="integer").dtype
+        elif dtype == "float32":
+            if pd.api.types.is_numeric_dtype(df[column]):
+                dtypes[column] = dtype
         else:
-            missing_images.append(foto_path)
-            img_tag = f"""
-            <br><a href="{foto_path}" target="_blank">
-                <img data-src="{thumbnail_path}"
-                     src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
-                     width="150"
-                     class="lazy-image"
-                >
-            </a>
-            """
-    html += img_tag
-    folium.CircleMarker(
-        location=(row["Latitude"], row["Longitude"]),
-        radius=6,
-        color=row['border_color'],
-        fill=True,
-        fill_color=row['fill_color'],
-        fill_opacity=0.85,
-        weight=1.5,
-        popup=folium.Popup(html, max_width=250),
-        tooltip=row["Kode"]
-    ).add_to(pijak_layer)
-
-if missing_images:
-    print("🚫 Missing local images:", missing_images)
-
-pijak_layer.add_to(m)
-
-print("🌳 22. Pijak markers added to map.")
-
-# Add image markers
-image_points = extract_gps_from_images(pictures_folder)
-add_image_markers(m, image_points, group_name="Geotagged Photos")
-
-print("📸 23. Image markers added to map.")
-
-# Create heatmap data
-df_pijak['Lat_bin'] = (df_pijak['Latitude'] * 10000).round() / 10000
-df_pijak['Lon_bin'] = (df_pijak['Longitude'] * 10000).round() / 10000
-zone_stats = df_pijak.groupby(['Lat_bin', 'Lon_bin']).agg(
-    Mort=('Tree Status', lambda x: (x == 'Dead').sum()),
-    Vivant=('Tree Status', lambda x: (x == 'Alive').sum()),
-    Latitude=('Latitude', 'mean'),
-    Longitude=('Longitude', 'mean')
-).reset_index()
-zone_stats['ratio'] = zone_stats['Mort'] / zone_stats['Vivant'].replace(0, 1)
-max_ratio = 10.0
-zone_stats['ratio_norm'] = zone_stats['ratio'].clip(upper=max_ratio) / max_ratio
-zone_stats = zone_stats[(zone_stats['Mort'] + zone_stats['Vivant']) >= 3]
-heat_data = [
-    [row['Latitude'], row['Longitude'], min(row['ratio_norm'] * 1.2, 1.0)]
-    for _, row in zone_stats.iterrows()
-]
-
-print("🔥 24. Heatmap data created.")
-
-# Add heatmap to map
-gradient = {
-    0.0: 'transparent',
-    0.25: 'darkgreen',
-    0.5: 'yellowgreen',
-    0.7: 'orange',
-    0.85: 'orangered',
-    1.0: 'red'
-}
-HeatMap(
-    heat_data,
-    min_opacity=0.6,
-    radius=12,
-    blur=4,
-    max_zoom=18,
-    gradient=gradient,
-    name="Heatmap (Dead/Alive Ratio)"
-).add_to(m)
-
-print("🔥 25. Heatmap added to map.")
-
-# Fix window.map
-fix_map_js = """
-<script>
-document.addEventListener("DOMContentLoaded", function() {
-    const mapDiv = document.querySelector("div[id^='map_']");
-    if (mapDiv && mapDiv._leaflet_map) {
-        window.map = mapDiv._leaflet_map;
-    }
-});
-</script>
-"""
-m.get_root().html.add_child(Element(fix_map_js))
-
+            dtypes[column] = dtype
+    return df.astype(dtypes)
+
+def report_memory(stage, df):
+    print(f"🧠 {stage}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB")
+
+def load_sites(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    sites = [{**DEFAULT_SITE, **site} for site in config.get("sites", [])]
+    names = [site["name"] for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate site names in {path}: {names}")
+    # Sites are built concurrently, sharing a root would mix up their outputs, caches and photo indexes
+    roots = [os.path.realpath(site["root"]) for site in sites]
+    if len(set(roots)) != len(roots):
+        raise ValueError(f"Sites in {path} must each have their own root: {[site['root'] for site in sites]}")
+    return sites
+
+def site_path(site, key):
+    return os.path.join(site["root"], site[key])
+
+# Static HTML/JS snippets added to the map
 fix_map_js = """
 <script>
 document.addEventListener("DOMContentLoaded", function() {
@@ -505,9 +733,7 @@ document.addEventListener("DOMContentLoaded", function() {
 });
 </script>
 """
-m.get_root().html.add_child(Element(fix_map_js))
 
-# Add status filter
 status_filter_html = """
 <div id="statusFilter" style="position: fixed; top: 170px; left: 10px; z-index: 9999; background: white; padding: 10px;
     border-radius: 8px; border: 1px solid #aaa; font-family: sans-serif; box-shadow: 2px 2px 6px rgba(0,0,0,0.2);">
@@ -541,49 +767,7 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 </script>
 """
-m.get_root().html.add_child(Element(status_filter_html))
-
-print("🛠️ 26. Fixed window.map and add status filter 🧪")
-
-# Add legend and layer control
-total = len(df_pijak)
-dead = (df_pijak['Tree Status'] == 'Dead').sum()
-alive = (df_pijak['Tree Status'] == 'Alive').sum()
-total_pct = f"{total/4103:.2%}"
-dead_pct = f"{dead/total:.2%}"
-alive_pct = f"{alive/total:.2%}"
-folium.LayerControl(collapsed=False).add_to(m)
-m.get_root().html.add_child(Element(f"""
-<div id="legendTotal" style="position: fixed; bottom: 200px; left: 10px; z-index: 9999; background-color: white; padding: 10px; border: 2px solid grey; border-radius: 8px; font-size: 14px;">
-    <b>Legend</b><br>
-    <b>Total geo-tagged with Pijak:</b> {total}/4103 ({total_pct})<br>
-    <span style='background-color:#ff9999;width:12px;height:12px;display:inline-block;margin-right:5px;'></span> Dead: {dead} ({dead_pct})<br>
-    <span style='background-color:#66ff66;width:12px;height:12px;display:inline-block;margin-right:5px;'></span> Alive: {alive} ({alive_pct})<br>
-</div>
-"""))
 
-print("📋 27. Legend and layer control added to map.")
-
-# Add download menu
-download_menu = f"""
-<div id="downloadMenu" style="position: fixed; top: 10px; left: 10px; z-index: 9999998;">
-  <details style="background: white; padding: 10px; border-radius: 8px; box-shadow: 1px 1px 5px #aaa;">
-    <summary style="cursor: pointer; font-weight: bold;">📥 Downloads</summary>
-    <div style="margin-top: 8px; line-height: 1.6;">
-      <a href="{output_csv}" download>📄 Download CSV</a><br>
-      <a href="{output_geojson}" download>🌍 Download Local GeoJSON</a><br>
-      <a href="{output_kml}" download>🌍 Download Local KML</a><br>
-      <a href="{output_geojson_pijak}" download>🌍 Download Pijak GeoJSON</a><br>
-      <a href="{output_kml_pijak}" download>🌍 Download Pijak KML</a>
-    </div>
-  </details>
-</div>
-"""
-m.get_root().html.add_child(Element(download_menu))
-
-print("📥 28. Download menu added to map.")
-
-# Add search functionality
 search_html = """
 <style>
     #searchContainer {
@@ -671,7 +855,8 @@ document.addEventListener("DOMContentLoaded", function () {
             list.style.display = 'none';
             return;
         }
-        const matches = codeList.filter(c => c.includes(query));
+        const lodCodes = Object.keys(window.lodCodes || {}).filter(c => !(c in codeToLayer));
+        const matches = codeList.concat(lodCodes).filter(c => c.includes(query));
         matches.slice(0, 20).forEach(match => {
             const item = document.createElement('div');
             item.className = 'autocompleteItem';
@@ -684,6 +869,10 @@ document.addEventListener("DOMContentLoaded", function () {
                     const latlng = layer.getLatLng();
                     window.map.setView(latlng, 19);
                     layer.openPopup();
+                } else if (window.lodCodes && window.lodCodes[match]) {
+                    // Tree loaded by viewport, its popup opens once its chunk is loaded
+                    window.lodPendingPopup = match;
+                    window.map.setView(window.lodCodes[match], 19);
                 }
             };
             list.appendChild(item);
@@ -698,11 +887,7 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 </script>
 """
-m.get_root().html.add_child(folium.Element(search_html))
-
-print("🔍 29. Search functionality added to map.")
 
-# Add lazy load script
 lazy_load_script = """
 <script>
 document.addEventListener("DOMContentLoaded", function () {
@@ -719,11 +904,7 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 </script>
 """
-m.get_root().html.add_child(folium.Element(lazy_load_script))
 
-print("🖼️ 30. Lazy load script added to map.")
-
-# Add toggle controls
 toggle_controls_html = """
 <div style="position: fixed; top: 10px; left: 127px; z-index: 9999999;">
   <details style="background: white; padding: 10px; border-radius: 8px; box-shadow: 1px 1px 5px #aaa; width: 104px;font-size: 13px !important;">
@@ -737,11 +918,7 @@ toggle_controls_html = """
   </details>
 </div>
 """
-m.get_root().html.add_child(folium.Element(toggle_controls_html))
-
-print("⚙️ 31. Toggle controls added to map.")
 
-# Add toggle controls script
 toggle_controls_script = """
 <script>
 document.addEventListener("DOMContentLoaded", function () {
@@ -768,11 +945,7 @@ document.addEventListener("DOMContentLoaded", function () {
 });
 </script>
 """
-m.get_root().html.add_child(folium.Element(toggle_controls_script))
 
-print("⚙️ 32. Toggle controls script added to map.")
-
-# Add responsive CSS
 responsive_css = """
 <style>
 .leaflet-popup-content img {
@@ -815,13 +988,8 @@ responsive_css = """
 }
 </style>
 """
-m.get_root().html.add_child(Element(responsive_css))
-
-print("📱 33. Responsive CSS added to map.")
 
-# Add legend
-legend = MacroElement()
-legend._template = Template("""
+legend_template = """
 {% macro html(this, kwargs) %}
 <div id="legendContainer" style="
     position: fixed;
@@ -846,90 +1014,1801 @@ legend._template = Template("""
     <div><span style="background-color: red; width: 20px; height: 12px; display: inline-block;"></span> &nbsp;Extreme (≥ 8.5:1)</div>
 </div>
 {% endmacro %}
-""")
-m.get_root().add_child(legend)
+"""
 
-print("📋 34. Legend added to map.")
+viewport_loader_template = """
+<style>
+.lodCluster div {
+    background: rgba(0, 102, 0, 0.75);
+    border: 2px solid white;
+    border-radius: 50%;
+    color: white;
+    font: bold 12px sans-serif;
+    text-align: center;
+    width: 100%;
+    height: 100%;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}
+</style>
+<script>
+document.addEventListener("DOMContentLoaded", function () {
+    const layers = {{ layers }};
+    const base = "{{ folder }}";
+
+    function tileRange(bounds, z) {
+        const n = Math.pow(2, z);
+        const clamp = v => Math.min(n - 1, Math.max(0, Math.floor(v)));
+        const toY = lat => {
+            const r = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+            return clamp((1 - Math.asinh(Math.tan(r)) / Math.PI) / 2 * n);
+        };
+        return {
+            x0: clamp((bounds.getWest() + 180) / 360 * n), x1: clamp((bounds.getEast() + 180) / 360 * n),
+            y0: toY(bounds.getNorth()), y1: toY(bounds.getSouth())
+        };
+    }
+
+    function statusOf(fillColor) {
+        const color = fillColor.toLowerCase();
+        if (color === "#66ff66") return "alive";
+        if (color === "#ff9999") return "dead";
+        return "unknown";
+    }
 
-# Save map
-m.save("tree_map.html")
-with open("tree_map.html", "r", encoding="utf-8") as f:
-    html = f.read()
-html = re.sub(r'^\s*window\.map\s*=\s*element_[a-f0-9]+;\s*$', '', html, flags=re.MULTILINE)
-if not html.lstrip().lower().startswith("<!doctype html>"):
-    html = "<!DOCTYPE html>\n" + html
+    function treeMarker(cfg, f) {
+        // [lat, lon, code, border color, fill color, popup]
+        const marker = L.circleMarker([f[0], f[1]], {
+            radius: cfg.radius, color: f[3], fill: true, fillColor: f[4], fillOpacity: cfg.fill_opacity, weight: cfg.weight
+        }).bindPopup(f[5], {maxWidth: 250}).bindTooltip(f[2]);
+        const status = statusOf(f[4]);
+        if (window.markersByStatus) {
+            window.markersByStatus[status].push(marker);
+        }
+        const checked = document.querySelector('input[name="statusFilter"]:checked');
+        if (checked && checked.value !== "all" && checked.value !== status) {
+            marker.setStyle({ opacity: 0, fillOpacity: 0 });
+        }
+        marker.lodCode = f[2];
+        return marker;
+    }
 
-print("💾 35. Map saved to tree_map.html.")
+    function photoMarker(f) {
+        // [lat, lon, popup]
+        return L.marker([f[0], f[1]], {
+            icon: L.AwesomeMarkers.icon({icon: "camera", prefix: "fa", markerColor: "blue"})
+        }).bindPopup(f[2], {maxWidth: "auto"});
+    }
 
-# Export GeoJSON Combined
-geojson = {
-    "type": "FeatureCollection",
-    "features": []
-}
-for _, row in df_latest.iterrows():
-    geojson["features"].append({
-        "type": "Feature",
-        "geometry": {"type": "Point", "coordinates": [row["longitude"], row["latitude"]]},
-        "properties": {
-            "tree_id": row["tree_id"],
-            "tree_name": row["tree_name"],
-            "code": row["code"],
-            "status": row["status"],
-            "source": "DB"
+    function issueMarker(f) {
+        // [lat, lon, color, popup, [lat, lon] of the Pijak position of a moved tree or null]
+        const group = L.layerGroup();
+        if (f[4]) {
+            L.polyline([[f[0], f[1]], f[4]], {color: "orange", weight: 2}).addTo(group);
         }
-    })
-for _, row in df_pijak.iterrows():
-    geojson["features"].append({
-        "type": "Feature",
-        "geometry": {"type": "Point", "coordinates": [row["Longitude"], row["Latitude"]]},
-        "properties": {
-            "tree_name": row["Nama pohon"],
-            "code": row["Kode"],
-            "status": row["Tree Status"],
-            "source": "PIJAK"
+        L.marker([f[0], f[1]], {
+            icon: L.AwesomeMarkers.icon({icon: "exclamation", prefix: "fa", markerColor: f[2]})
+        }).bindPopup(f[3], {maxWidth: 250}).addTo(group);
+        return group;
+    }
+
+    function clusterMarker(cfg, f) {
+        // [lat, lon, count, alive, dead]
+        const size = Math.round(24 + 6 * Math.log10(f[2]));
+        const popup = cfg.kind === "issue" ? f[2] + " flagged trees"
+            : cfg.kind === "photo" ? f[2] + " photos"
+            : f[2] + " trees<br>Alive: " + f[3] + "<br>Dead: " + f[4];
+        return L.marker([f[0], f[1]], {
+            icon: L.divIcon({className: "lodCluster", html: "<div>" + f[2] + "</div>", iconSize: [size, size]})
+        }).bindPopup(popup);
+    }
+
+    function redrawHeat(cfg) {
+        // [lat, lon, intensity] of the loaded chunks, drawn by a single heat layer
+        window[cfg.group].setLatLngs([].concat(...Object.values(cfg.loaded)));
+    }
+
+    function unload(cfg, key) {
+        if (cfg.kind === "heat") {
+            delete cfg.loaded[key];
+            redrawHeat(cfg);
+            return;
         }
-    })
-with open(output_geojson, "w", encoding="utf-8") as f:
-    json.dump(geojson, f, indent=2)
+        const chunk = cfg.loaded[key];
+        window[cfg.group].removeLayer(chunk);
+        if (window.markersByStatus) {
+            for (const s in window.markersByStatus) {
+                window.markersByStatus[s] = window.markersByStatus[s].filter(marker => !chunk.hasLayer(marker));
+            }
+        }
+        delete cfg.loaded[key];
+    }
 
-print(f"📁 36. GeoJSON combined saved to {output_geojson}.")
+    function load(cfg, key, detail) {
+        if (cfg.kind === "heat") {
+            const pending = [];
+            cfg.loaded[key] = pending;
+            fetch(base + "/" + cfg.key + "/" + key + ".json").then(r => r.json()).then(features => {
+                if (cfg.loaded[key] === pending) {
+                    cfg.loaded[key] = features;
+                    redrawHeat(cfg);
+                }
+            });
+            return;
+        }
+        const chunk = L.layerGroup();
+        cfg.loaded[key] = chunk;
+        window[cfg.group].addLayer(chunk);
+        fetch(base + "/" + cfg.key + "/" + key + ".json").then(r => r.json()).then(features => {
+            if (cfg.loaded[key] !== chunk) {
+                return;
+            }
+            features.forEach(f => {
+                if (!detail) {
+                    chunk.addLayer(clusterMarker(cfg, f));
+                } else if (cfg.kind === "photo") {
+                    chunk.addLayer(photoMarker(f));
+                } else if (cfg.kind === "issue") {
+                    chunk.addLayer(issueMarker(f));
+                } else {
+                    const marker = treeMarker(cfg, f);
+                    chunk.addLayer(marker);
+                    if (window.lodPendingPopup === marker.lodCode) {
+                        window.lodPendingPopup = null;
+                        marker.openPopup();
+                    }
+                }
+            });
+        });
+    }
 
-# Export GeoJSON Pijak Only
-geojson_pijak = {
-    "type": "FeatureCollection",
-    "features": []
-}
-for _, row in df_pijak.iterrows():
-    geojson_pijak["features"].append({
-        "type": "Feature",
-        "geometry": {"type": "Point", "coordinates": [row["Longitude"], row["Latitude"]]},
-        "properties": {
-            "tree_name": row["Nama pohon"],
-            "code": row["Kode"],
-            "status": row["Tree Status"]
+    function refresh(cfg) {
+        const group = window[cfg.group];
+        const manifest = cfg.manifest;
+        if (!manifest) {
+            return;
         }
-    })
-with open(output_geojson_pijak, "w", encoding="utf-8") as f:
-    json.dump(geojson_pijak, f, indent=2)
+        const wanted = {};
+        if (window.map.hasLayer(group)) {
+            const z = Math.max(manifest.min_zoom, Math.min(manifest.detail_zoom, Math.floor(window.map.getZoom())));
+            const available = manifest.chunks[z] || {};
+            const r = tileRange(window.map.getBounds().pad(0.2), z);
+            // Zoomed out, the viewport spans far more tiles than there are chunks, so test the chunks
+            Object.keys(available).forEach(tile => {
+                const [x, y] = tile.split("/").map(Number);
+                const key = z + "/" + tile;
+                if (x >= r.x0 && x <= r.x1 && y >= r.y0 && y <= r.y1) {
+                    wanted[key] = true;
+                    if (!(key in cfg.loaded)) {
+                        load(cfg, key, z === manifest.detail_zoom);
+                    }
+                }
+            });
+        }
+        Object.keys(cfg.loaded).forEach(key => {
+            if (!wanted[key]) {
+                unload(cfg, key);
+            }
+        });
+    }
 
-print(f"📁 37. GeoJSON Pijak only saved to {output_geojson_pijak}.")
+    function refreshAll() {
+        layers.forEach(refresh);
+    }
+
+    layers.forEach(cfg => {
+        cfg.loaded = {};
+        fetch(base + "/" + cfg.key + "/index.json").then(r => r.json()).then(manifest => {
+            cfg.manifest = manifest;
+            refresh(cfg);
+        });
+    });
+    window.map.on("moveend overlayadd overlayremove", refreshAll);
+
+    // Codes of every tree for the search box, only fetched once the search is used
+    const input = document.getElementById("searchInput");
+    if (input) {
+        input.addEventListener("focus", function () {
+            if (!window.lodCodes) {
+                window.lodCodes = {};
+                fetch(base + "/codes.json").then(r => r.json()).then(codes => { window.lodCodes = codes; });
+            }
+        }, {once: true});
+    }
+});
+</script>
+"""
+
+# Pipeline stages
+def process_db_file(db_path, root="."):
+    db_name = os.path.splitext(os.path.basename(db_path))[0]
+    out_csv = os.path.join(root, f"geotagged_tree_{db_name}.csv")
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query(query, conn)
+    conn.close()
+    df = df[df['statusApproval'] != 'NeedAction']
+    df.to_csv(out_csv, index=False)
+    return out_csv
+
+def aggregate_db(frames):
+    # Aggregate data from all CSV files
+    # Categories differ between .db files and are lost by concat, cast again afterwards
+    df_all = apply_schema(pd.concat(frames, ignore_index=True), DB_SCHEMA)
+    df_all['monitoring_date'] = pd.to_datetime(df_all['monitoring_date'], errors='coerce')
+    df_all['code'] = df_all['code'].str.replace(r'^MAN-(\d{1})$', r'MAN-00\1', regex=True)
+    df_all['code'] = df_all['code'].str.replace(r'^MAN-(\d{2})$', r'MAN-0\1', regex=True)
+    df_all['code'] = df_all['code'].str.replace(r'^MAN', 'JJK', regex=True)
+    df_latest = df_all.sort_values('monitoring_date').dropna(subset=['code']).drop_duplicates('code', keep='last')
+    report_memory("All monitorings", df_all)
+    report_memory("Latest monitoring per tree", df_latest)
+
+    print("📊 11. Data aggregated from all CSV files.")
+    return df_latest
+
+def init_sheets_client():
+    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=[
+        "https://www.googleapis.com/auth/spreadsheets.readonly",
+        "https://www.googleapis.com/auth/drive.readonly"
+    ])
+    return gspread.authorize(creds)
+
+def fetch_tree_status_values(gc, sheet_name=SHEET_NAME, worksheet_name=WORKSHEET_NAME):
+    ws = gc.open(sheet_name).worksheet(worksheet_name)
+    return ws.get_all_values()
+
+def load_tree_status(data):
+    df_status = pd.DataFrame(data[1:], columns=data[0]).iloc[:, :2]
+    df_status.columns = ['code', 'status']
+    df_status = df_status.astype({"code": CODE_DTYPE})
+
+    print("📚 12. Data fetched from Google Sheets.")
+    return df_status
+
+def merge_status(df_latest, df_status):
+    # Merge status data
+    df_latest = df_latest.merge(df_status, on="code", how="left")
+    df_latest["status"] = df_latest["status"].fillna("Unknown")
+    df_latest[["border_color", "fill_color"]] = status_colors(df_latest["status"], get_color_tuple)
+    df_latest = apply_schema(df_latest, DB_SCHEMA)
+    report_memory("Latest monitoring with status", df_latest)
+    return df_latest
+
+def fetch_pijak_records(gc, sheet_name=SHEET_NAME):
+    return gc.open(sheet_name).worksheet("Pijak DB").get_all_records()
+
+def load_pijak(records):
+    # Load Pijak DB
+    df_pijak = pd.DataFrame(records)
+    df_pijak = df_pijak[df_pijak['Status'].str.lower().str.strip().str.contains("geotag")]
+    df_pijak['Latitude'] = pd.to_numeric(df_pijak['Latitude'], errors='coerce')
+    df_pijak['Longitude'] = pd.to_numeric(df_pijak['Longitude'], errors='coerce')
+    df_pijak = df_pijak.dropna(subset=['Latitude', 'Longitude'])
+    df_pijak['Kode'] = df_pijak['Kode'].apply(remap_kode)
+    df_pijak[["border_color", "fill_color"]] = status_colors(df_pijak["Tree Status"], get_pijak_colors)
+    df_pijak = apply_schema(df_pijak, PIJAK_SCHEMA)
+    report_memory("Pijak DB", df_pijak)
+
+    print("📚 14. Pijak DB loaded and processed.")
+    return df_pijak
+
+def init_earth_engine(project, ee_module=ee):
+    ee_module.Authenticate()
+    ee_module.Initialize(project=project)
+
+def get_sentinel_image(sentinel_point, sentinel_dates, ee_module=ee):
+    lat, lon = sentinel_point
+    point = ee_module.Geometry.Point([lon, lat])
+    sentinel = ee_module.ImageCollection('COPERNICUS/S2_HARMONIZED') \
+        .filterBounds(point) \
+        .filterDate(*sentinel_dates) \
+        .filter(ee_module.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10)) \
+        .median()
+    return sentinel
+
+def get_ndvi_image(sentinel):
+    return sentinel.normalizedDifference(['B8', 'B4']).rename('NDVI')
+
+def get_ee_tiles(sentinel, ee_module=ee):
+    rgb = sentinel.visualize(
+        bands=['B4', 'B3', 'B2'],
+        min=0,
+        max=3000
+    ).reproject(crs='EPSG:4326', scale=10)
+    rgb_mapid = ee_module.data.getMapId({'image': rgb})
+    ndvi = get_ndvi_image(sentinel)
+    ndvi_vis = ndvi.visualize(min=0.0, max=1.0, palette=['blue', 'white', 'green'])
+    ndvi_tiles = ee_module.data.getMapId({'image': ndvi_vis})['tile_fetcher'].url_format
+    return {"rgb": rgb_mapid['tile_fetcher'].url_format, "ndvi": ndvi_tiles}
+
+def sample_image(image, lats, lons, ee_module=ee, batch_size=ndvi_batch_size, scale=ndvi_scale):
+    """Value of a single-band image at each coordinate, with one reduceRegions call per batch of points."""
+    values = [None] * len(lats)
+    for start in range(0, len(lats), batch_size):
+        features = [
+            ee_module.Feature(ee_module.Geometry.Point([float(lon), float(lat)]), {"i": i})
+            for i, lat, lon in zip(range(start, len(lats)), lats[start:start + batch_size], lons[start:start + batch_size])
+        ]
+        sampled = image.reduceRegions(
+            collection=ee_module.FeatureCollection(features),
+            reducer=ee_module.Reducer.first().setOutputs(["value"]),
+            scale=scale
+        ).getInfo()
+        for feature in sampled["features"]:
+            values[feature["properties"]["i"]] = feature["properties"].get("value")
+    return values
+
+def reconcile(df_latest, df_pijak, moved_threshold_m=reconcile_moved_m):
+    """Compare the previous DB with the Pijak sheet tree by tree.
+
+    Flags trees missing from one side, with a duplicated code, moved further than
+    `moved_threshold_m` or whose Alive/Dead status differs.
+    """
+    db = pd.DataFrame({
+        "code": canonical_code(df_latest["code"]),
+        "db_latitude": df_latest["latitude"].values,
+        "db_longitude": df_latest["longitude"].values,
+        "db_status": df_latest["status"].values
+    })
+    pijak = pd.DataFrame({
+        "code": canonical_code(df_pijak["Kode"]),
+        "pijak_latitude": df_pijak["Latitude"].values,
+        "pijak_longitude": df_pijak["Longitude"].values,
+        "pijak_status": df_pijak["Tree Status"].values
+    })
+    db_counts = db["code"].value_counts().rename("db_count")
+    pijak_counts = pijak["code"].value_counts().rename("pijak_count")
 
-# Export KML Combined
-kml = simplekml.Kml()
-for _, row in df_latest.iterrows():
-    kml.newpoint(name=str(row["code"]), description=f"[DB] {row['tree_name']}", coords=[(row["longitude"], row["latitude"])])
-for _, row in df_pijak.iterrows():
-    kml.newpoint(name=str(row["Kode"]), description=f"[PIJAK] {row['Nama pohon']}", coords=[(row["Longitude"], row["Latitude"])])
-kml.save(output_kml)
+    df = db.drop_duplicates("code", keep="last").merge(
+        pijak.drop_duplicates("code", keep="last"), on="code", how="outer", indicator=True
+    )
+    df = df.join(db_counts, on="code").join(pijak_counts, on="code")
+    df[["db_count", "pijak_count"]] = df[["db_count", "pijak_count"]].fillna(0).astype(int)
+
+    df["displacement_m"] = haversine_m(df["db_latitude"], df["db_longitude"], df["pijak_latitude"], df["pijak_longitude"])
+    db_status = df["db_status"].astype(str).str.strip().str.lower()
+    pijak_status = df["pijak_status"].astype(str).str.strip().str.lower()
+    known = db_status.isin(["alive", "dead"]) & pijak_status.isin(["alive", "dead"])
+
+    df["missing_in_pijak"] = df["_merge"] == "left_only"
+    df["missing_in_db"] = df["_merge"] == "right_only"
+    df["duplicate"] = (df["db_count"] > 1) | (df["pijak_count"] > 1)
+    df["moved"] = df["displacement_m"] > moved_threshold_m
+    df["status_changed"] = known & (db_status != pijak_status)
+    flags = ["missing_in_pijak", "missing_in_db", "duplicate", "moved", "status_changed"]
+    df["issues"] = df[flags].apply(lambda col: np.where(col, col.name + ";", "")).sum(axis=1).str.rstrip(";")
+    df = df.drop(columns="_merge").sort_values("code").reset_index(drop=True)
+    report_memory("Reconciliation", df)
+
+    print("🧮 Reconciliation: " + ", ".join(f"{flag} {df[flag].sum()}" for flag in flags) + ".")
+    return df
+
+reconciliation_colors = {
+    "moved": "orange",
+    "status_changed": "red",
+    "duplicate": "black",
+    "missing_in_pijak": "purple",
+    "missing_in_db": "cadetblue"
+}
 
-print(f"📁 38. KML combined saved to {output_kml}.")
+def reconciliation_markers(df_reconciliation):
+    """[lat, lon, color, popup, Pijak position of a moved tree or None] of each flagged tree."""
+    markers = []
+    flagged = df_reconciliation[df_reconciliation["issues"] != ""]
+    for _, row in flagged.iterrows():
+        issue = row["issues"].split(";")[0]
+        if row["missing_in_db"]:
+            location = (row["pijak_latitude"], row["pijak_longitude"])
+        else:
+            location = (row["db_latitude"], row["db_longitude"])
+        if pd.isna(location[0]) or pd.isna(location[1]):
+            continue
+        popup_html = (
+            f"<b>Code:</b> {row['code']}<br>"
+            f"<b>Issues:</b> {row['issues'].replace(';', ', ')}<br>"
+            f"<b>DB status:</b> {row['db_status']}<br>"
+            f"<b>Pijak status:</b> {row['pijak_status']}"
+        )
+        moved_to = None
+        if row["moved"]:
+            popup_html += f"<br><b>Moved:</b> {row['displacement_m']:.1f} m"
+            moved_to = [float(row["pijak_latitude"]), float(row["pijak_longitude"])]
+        markers.append([float(location[0]), float(location[1]), reconciliation_colors[issue], popup_html, moved_to])
+    return markers
+
+def add_reconciliation_layer(map_object, df_reconciliation, lod=False):
+    """Add the reconciliation layer, left empty with `lod` for the viewport loader to fill, and return it with its markers."""
+    feature_group = folium.FeatureGroup(name="Reconciliation (DB vs Pijak)", show=False)
+    markers = reconciliation_markers(df_reconciliation)
+    if not lod:
+        for lat, lon, color, popup_html, moved_to in markers:
+            if moved_to:
+                folium.PolyLine(
+                    [(lat, lon), moved_to],
+                    color=reconciliation_colors["moved"],
+                    weight=2
+                ).add_to(feature_group)
+            folium.Marker(
+                location=(lat, lon),
+                popup=folium.Popup(popup_html, max_width=250),
+                icon=folium.Icon(color=color, icon="exclamation", prefix="fa")
+            ).add_to(feature_group)
+    feature_group.add_to(map_object)
+    return feature_group, markers
+
+def ndvi_value(row):
+    ndvi = row.get("ndvi")
+    return None if ndvi is None or pd.isna(ndvi) else round(float(ndvi), 3)
+
+def ndvi_html(row):
+    ndvi = ndvi_value(row)
+    return "" if ndvi is None else f"<br><b>NDVI:</b> {ndvi:.2f}"
+
+def tile_xy(lats, lons, zoom):
+    """Vectorized slippy map tile coordinates of points at `zoom`."""
+    n = 2 ** zoom
+    lat_rad = np.radians(np.clip(np.asarray(lats, dtype=float), -85.0511, 85.0511))
+    x = np.floor((np.asarray(lons, dtype=float) + 180) / 360 * n).astype(np.int64)
+    y = np.floor((1 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2 * n).astype(np.int64)
+    return np.clip(x, 0, n - 1), np.clip(y, 0, n - 1)
+
+def write_lod_chunks(points, folder, min_zoom=lod_min_zoom, detail_zoom=lod_detail_zoom, cluster_depth=lod_cluster_depth):
+    """Partition points in tile chunks, `folder`/{z}/{x}/{y}.json, plus an index.json manifest.
+
+    `points` has lat, lon and status columns and a `feature` column holding the JSON
+    array drawn by the page at detail zoom. Below it, each chunk holds the tree count
+    per cell of the tile subdivided `cluster_depth` times.
+    """
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    points = points.astype({"lat": float, "lon": float})
+    points = points[np.isfinite(points["lat"]) & np.isfinite(points["lon"])]
+    status = points["status"].astype(str).str.strip().str.lower()
+    chunks = {}
+
+    x, y = tile_xy(points["lat"], points["lon"], detail_zoom)
+    chunks[detail_zoom] = {}
+    for (tx, ty), features in points["feature"].groupby([x, y]):
+        chunks[detail_zoom][f"{tx}/{ty}"] = features.tolist()
+
+    counts = pd.DataFrame({
+        "lat": points["lat"],
+        "lon": points["lon"],
+        "alive": (status == "alive").astype(int),
+        "dead": (status == "dead").astype(int)
+    })
+    for zoom in range(min_zoom, detail_zoom):
+        x, y = tile_xy(points["lat"], points["lon"], zoom)
+        cx, cy = tile_xy(points["lat"], points["lon"], zoom + cluster_depth)
+        cells = counts.groupby([x, y, cx, cy]).agg(
+            lat=("lat", "mean"), lon=("lon", "mean"), count=("lat", "size"), alive=("alive", "sum"), dead=("dead", "sum")
+        )
+        chunks[zoom] = {}
+        for (tx, ty), tile_cells in cells.groupby(level=[0, 1]):
+            chunks[zoom][f"{tx}/{ty}"] = [
+                [round(lat, 7), round(lon, 7), int(count), int(alive), int(dead)]
+                for lat, lon, count, alive, dead in tile_cells.itertuples(index=False)
+            ]
+
+    for zoom, tiles in chunks.items():
+        for key, features in tiles.items():
+            path = os.path.join(folder, str(zoom), key + ".json")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(features, f, separators=(",", ":"))
+    os.makedirs(folder, exist_ok=True)
+    manifest = {
+        "min_zoom": min_zoom,
+        "detail_zoom": detail_zoom,
+        "chunks": {zoom: {key: len(features) for key, features in tiles.items()} for zoom, tiles in chunks.items()}
+    }
+    with open(os.path.join(folder, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    print(f"🧩 {len(points)} points split in {sum(len(tiles) for tiles in chunks.values())} chunks in {folder}.")
+
+def download_pijak_photos(df_pijak, site=DEFAULT_SITE, cancelled=None, store=None):
+    """Download the Pijak photos missing from the photo store concurrently, stops early once `cancelled` is set.
+
+    Each URL is downloaded once, and an image downloaded from several URLs is stored once.
+    """
+    store = store or photo_store(site, "pijak_pictures_folder", "pijak_pictures_index")
+    os.makedirs(store.folder, exist_ok=True)
+
+    def download(kode, foto_path):
+        if cancelled is not None and cancelled.is_set():
+            return
+        part_path = store.path(f".{hashlib.sha1(foto_path.encode()).hexdigest()}.part")
+        try:
+            print(f"⬇️ Downloading missing image for {kode} from {foto_path}...")
+            with urllib.request.urlopen(foto_path, timeout=download_timeout_seconds) as response:
+                with open(part_path, "wb") as f:
+                    shutil.copyfileobj(response, f)
+            name = store.add(part_path, foto_path, photo_suffix(foto_path))
+            print(f"✅ Image saved to {store.path(name)}")
+        except Exception as e:
+            print(f"❌ Failed to download image for {kode}: {e}")
+            # A partial file in the watched folder would trigger another rebuild
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    urls = df_pijak.get("Foto 1", pd.Series(dtype=object))
+    # A file name shared by several URLs cannot tell which of them a legacy file came from
+    name_counts = pd.Series(urls[urls.astype(bool)].unique(), dtype=object).map(os.path.basename).value_counts()
+    missing = {}
+    for kode, foto_path in zip(df_pijak["Kode"], urls):
+        if not foto_path or foto_path in missing or store.lookup(foto_path):
+            continue
+        # Photos saved under their URL file name before the store existed are adopted once
+        legacy_path = store.path(os.path.basename(foto_path))
+        if name_counts.get(os.path.basename(foto_path)) == 1 and os.path.isfile(legacy_path):
+            store.add(legacy_path, foto_path, photo_suffix(foto_path))
+            continue
+        missing[foto_path] = kode
+    if missing:
+        with ThreadPoolExecutor(max_workers=download_workers) as pool:
+            for foto_path, kode in missing.items():
+                pool.submit(download, kode, foto_path)
+
+    stored = {store.files[name]["sha256"]: name for name in sorted(set(store.urls.values())) if name in store.files}
+    store.describe(stored, gps=False)
+    store.find_near_duplicates(stored)
+    store.save()
+
+def build_map(df_latest, df_pijak, image_points, ee_tiles, db_photos=None, pijak_photos=None, df_reconciliation=None,
+              site=DEFAULT_SITE, pijak_store=None):
+    # Create map
+    center_lat = df_latest["latitude"].mean()
+    center_lon = df_latest["longitude"].mean()
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=19, control_scale=True, tiles="OpenStreetMap")
+
+    print("🌍 15. Map initialized.")
+
+    # Add favicon, title, and meta viewport
+    favicon = Element('''
+    <link rel="icon" href="favicon.ico" type="image/x-icon">
+    ''')
+    m.get_root().html.add_child(favicon)
+
+    title = Element('''
+    <title>🌱 Mangrove Project</title>
+    ''')
+    m.get_root().html.add_child(title)
+
+    meta_viewport = Element('''
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
+    ''')
+    m.get_root().html.add_child(meta_viewport)
+
+    print("📌 16. Favicon, title, and meta viewport added to map.")
+
+    # Add Google Earth Engine Layer
+    folium.TileLayer(
+        tiles=ee_tiles["rgb"],
+        attr='Sentinel-2 10m',
+        name='Sentinel-2 10m (low res)',
+        overlay=False,
+        control=True
+    ).add_to(m)
+
+    print("🛰️ 17. Google Earth Engine Layer added to map.")
+
+    # Add NDVI Layer
+    folium.TileLayer(
+        tiles=ee_tiles["ndvi"],
+        attr='NDVI',
+        name='🌿 Sentinel NDVI (low res)',
+        overlay=False,
+        control=True
+    ).add_to(m)
+
+    print("🌿 18. NDVI Layer added to map.")
+
+    # Add ESRI Layer
+    m.add_child(AssignMapToWindow())
+    folium.TileLayer(
+        name="Satellite (ESRI)",
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        attr="Tiles © Esri"
+    ).add_to(m)
+    Fullscreen(position="topright").add_to(m)
+
+    print("🌐 19. ESRI Layer added to map.")
+
+    # Add Google Maps Layer
+    folium.TileLayer(
+        name="Satellite (Google)",
+        tiles="http://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}",
+        attr="Google Satellite",
+        max_zoom=21,
+        min_zoom=0,
+        overlay=False,
+        control=True
+    ).add_to(m)
+
+    print("🗺️ 20. Google Maps Layer added to map.")
+
+    # Add markers for trees, or collect them for the viewport chunks
+    lod = site["viewport_loading"]
+    lod_points = {"db": [], "pijak": [], "photos": [], "issues": [], "heat": []}
+    tree_layer = folium.FeatureGroup(name="Previous DB", show=False)
+    marker_dict = {}
+    db_photos = db_photos or {}
+    pijak_photos = pijak_photos or {}
+    pijak_store = pijak_store or photo_store(site, "pijak_pictures_folder", "pijak_pictures_index")
+    for _, row in df_latest.iterrows():
+        coord = (row["latitude"], row["longitude"])
+        popup_html = (
+            f"<b>ID:</b> {row['tree_id']}<br>"
+            f"<b>Code:</b> {row['code']}<br>"
+            f"<b>Status:</b> {row['status']}"
+            f"{ndvi_html(row)}"
+        )
+        if row['code'] in db_photos:
+            popup_html += tree_photos_html(db_photos[row['code']], site)
+        if lod:
+            lod_points["db"].append((
+                coord[0], coord[1], row["status"],
+                [coord[0], coord[1], str(row["code"]), row["border_color"], row["fill_color"], popup_html]
+            ))
+            continue
+        marker = folium.CircleMarker(
+            location=coord,
+            radius=5,
+            color=row["border_color"],
+            fill=True,
+            fill_color=row["fill_color"],
+            fill_opacity=0.9,
+            weight=1,
+            popup=folium.Popup(popup_html, max_width=250),
+            tooltip=row["code"]
+        )
+        marker.add_to(tree_layer)
+        marker_dict[row['code']] = marker
+    tree_layer.add_to(m)
+
+    print("🌳 21. Tree markers added to map.")
+
+    # Add markers for Pijak DB
+    pijak_layer = folium.FeatureGroup(name="Current DB")
+    missing_images = []
+    for _, row in df_pijak.iterrows():
+        html = f"<b>Kode:</b> {row['Kode']}<br><b>Status:</b> {row['Tree Status']}{ndvi_html(row)}"
+        foto_path = row.get("Foto 1")
+        img_tag = "<br><em>Picture not available</em>"
+        if foto_path:
+            local_filename = pijak_store.lookup(foto_path)
+            if local_filename:
+                local_path = os.path.join(site["pijak_pictures_folder"], local_filename)
+                if site["thumbnails"]:
+                    thumbnail_path = f"{site['pijak_pictures_folder']}/thumbnails/tn_{local_filename}"
+                else:
+                    thumbnail_path = local_path
+            else:
+                missing_images.append(foto_path)
+                thumbnail_path = foto_path
 
-# Export KML Pijak Only
-kml_pijak = simplekml.Kml()
-for _, row in df_pijak.iterrows():
-    kml_pijak.newpoint(name=str(row["Kode"]), description=row["Nama pohon"], coords=[(row["Longitude"], row["Latitude"])])
-kml_pijak.save(output_kml_pijak)
+            img_tag = f"""
+            <br><a href="{foto_path}" target="_blank">
+                <img data-src="{thumbnail_path}"
+                     src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///ywAAAAAAQABAAACAUwAOw=="
+                     width="150"
+                     class="lazy-image"
+                >
+            </a>
+            """
+        html += img_tag
+        if row['Kode'] in pijak_photos:
+            html += tree_photos_html(pijak_photos[row['Kode']], site)
+        if lod:
+            lod_points["pijak"].append((
+                row["Latitude"], row["Longitude"], row["Tree Status"],
+                [row["Latitude"], row["Longitude"], str(row["Kode"]), row["border_color"], row["fill_color"], html]
+            ))
+            continue
+        folium.CircleMarker(
+            location=(row["Latitude"], row["Longitude"]),
+            radius=6,
+            color=row['border_color'],
+            fill=True,
+            fill_color=row['fill_color'],
+            fill_opacity=0.85,
+            weight=1.5,
+            popup=folium.Popup(html, max_width=250),
+            tooltip=row["Kode"]
+        ).add_to(pijak_layer)
+
+    if missing_images:
+        print("🚫 Missing local images:", missing_images)
+
+    pijak_layer.add_to(m)
+
+    print("🌳 22. Pijak markers added to map.")
+
+    # Add image markers
+    photo_codes = {file_path: code for code, files in pijak_photos.items() for file_path in files}
+    if lod:
+        photo_layer = folium.FeatureGroup(name="Geotagged Photos", show=False)
+        photo_layer.add_to(m)
+        for lat, lon, file_path in image_points:
+            popup_html = image_popup_html(file_path, photo_codes, site)
+            if popup_html is not None:
+                lod_points["photos"].append((lat, lon, "", [lat, lon, popup_html]))
+    else:
+        add_image_markers(m, image_points, group_name="Geotagged Photos", photo_codes=photo_codes, site=site)
+
+    print("📸 23. Image markers added to map.")
+
+    # Add reconciliation layer
+    issue_layer = None
+    if df_reconciliation is not None:
+        issue_layer, issue_markers = add_reconciliation_layer(m, df_reconciliation, lod)
+        lod_points["issues"] = [(marker[0], marker[1], "", marker) for marker in issue_markers]
+
+    # Create heatmap data
+    lat_bin = ((df_pijak['Latitude'] * 10000).round() / 10000).rename('Lat_bin')
+    lon_bin = ((df_pijak['Longitude'] * 10000).round() / 10000).rename('Lon_bin')
+    zone_stats = df_pijak.groupby([lat_bin, lon_bin]).agg(
+        Mort=('Tree Status', lambda x: (x == 'Dead').sum()),
+        Vivant=('Tree Status', lambda x: (x == 'Alive').sum()),
+        Latitude=('Latitude', 'mean'),
+        Longitude=('Longitude', 'mean')
+    ).reset_index()
+    zone_stats['ratio'] = zone_stats['Mort'] / zone_stats['Vivant'].replace(0, 1)
+    max_ratio = 10.0
+    zone_stats['ratio_norm'] = zone_stats['ratio'].clip(upper=max_ratio) / max_ratio
+    zone_stats = zone_stats[(zone_stats['Mort'] + zone_stats['Vivant']) >= 3]
+    heat_data = [
+        [row['Latitude'], row['Longitude'], min(row['ratio_norm'] * 1.2, 1.0)]
+        for _, row in zone_stats.iterrows()
+    ]
+    if lod:
+        lod_points["heat"] = [(lat, lon, "", [round(lat, 7), round(lon, 7), round(weight, 3)])
+                              for lat, lon, weight in heat_data]
+        heat_data = []
+
+    print("🔥 24. Heatmap data created.")
+
+    # Add heatmap to map
+    gradient = {
+        0.0: 'transparent',
+        0.25: 'darkgreen',
+        0.5: 'yellowgreen',
+        0.7: 'orange',
+        0.85: 'orangered',
+        1.0: 'red'
+    }
+    heatmap = HeatMap(
+        heat_data,
+        min_opacity=0.6,
+        radius=12,
+        blur=4,
+        max_zoom=18,
+        gradient=gradient,
+        name="Heatmap (Dead/Alive Ratio)"
+    ).add_to(m)
+
+    print("🔥 25. Heatmap added to map.")
+
+    # Fix window.map
+    m.get_root().html.add_child(Element(fix_map_js))
+    m.get_root().html.add_child(Element(fix_map_js))
+
+    # Add status filter
+    m.get_root().html.add_child(Element(status_filter_html))
+
+    print("🛠️ 26. Fixed window.map and add status filter 🧪")
+
+    # Add legend and layer control
+    target = site["target_trees"]
+    total = len(df_pijak)
+    dead = (df_pijak['Tree Status'] == 'Dead').sum()
+    alive = (df_pijak['Tree Status'] == 'Alive').sum()
+    total_pct = f"{total/target:.2%}"
+    dead_pct = f"{dead/total:.2%}"
+    alive_pct = f"{alive/total:.2%}"
+    folium.LayerControl(collapsed=False).add_to(m)
+    m.get_root().html.add_child(Element(f"""
+    <div id="legendTotal" style="position: fixed; bottom: 200px; left: 10px; z-index: 9999; background-color: white; padding: 10px; border: 2px solid grey; border-radius: 8px; font-size: 14px;">
+        <b>Legend</b><br>
+        <b>Total geo-tagged with Pijak:</b> {total}/{target} ({total_pct})<br>
+        <span style='background-color:#ff9999;width:12px;height:12px;display:inline-block;margin-right:5px;'></span> Dead: {dead} ({dead_pct})<br>
+        <span style='background-color:#66ff66;width:12px;height:12px;display:inline-block;margin-right:5px;'></span> Alive: {alive} ({alive_pct})<br>
+    </div>
+    """))
+
+    print("📋 27. Legend and layer control added to map.")
+
+    # Add download menu
+    download_menu = f"""
+    <div id="downloadMenu" style="position: fixed; top: 10px; left: 10px; z-index: 9999998;">
+      <details style="background: white; padding: 10px; border-radius: 8px; box-shadow: 1px 1px 5px #aaa;">
+        <summary style="cursor: pointer; font-weight: bold;">📥 Downloads</summary>
+        <div style="margin-top: 8px; line-height: 1.6;">
+          <a href="{site['output_csv']}" download>📄 Download CSV</a><br>
+          <a href="{site['output_geojson']}" download>🌍 Download Local GeoJSON</a><br>
+          <a href="{site['output_kml']}" download>🌍 Download Local KML</a><br>
+          <a href="{site['output_geojson_pijak']}" download>🌍 Download Pijak GeoJSON</a><br>
+          <a href="{site['output_kml_pijak']}" download>🌍 Download Pijak KML</a><br>
+          <a href="{site['output_reconciliation']}" download>🧮 Download Reconciliation Report</a>
+        </div>
+      </details>
+    </div>
+    """
+    m.get_root().html.add_child(Element(download_menu))
+
+    print("📥 28. Download menu added to map.")
+
+    # Add search functionality
+    m.get_root().html.add_child(folium.Element(search_html))
+
+    print("🔍 29. Search functionality added to map.")
+
+    # Add lazy load script
+    m.get_root().html.add_child(folium.Element(lazy_load_script))
+
+    print("🖼️ 30. Lazy load script added to map.")
+
+    # Add viewport loading of the tree and photo chunks
+    if lod:
+        tiles_folder = site_path(site, "tiles_folder")
+        layers = [
+            {"key": "db", "group": tree_layer.get_name(), "kind": "tree", "radius": 5, "fill_opacity": 0.9, "weight": 1},
+            {"key": "pijak", "group": pijak_layer.get_name(), "kind": "tree", "radius": 6, "fill_opacity": 0.85, "weight": 1.5},
+            {"key": "photos", "group": photo_layer.get_name(), "kind": "photo"},
+            # Heat points are already binned, their chunks are loaded as is at every zoom
+            {"key": "heat", "group": heatmap.get_name(), "kind": "heat", "zoom": lod_min_zoom}
+        ]
+        if issue_layer is not None:
+            layers.append({"key": "issues", "group": issue_layer.get_name(), "kind": "issue"})
+        for layer in layers:
+            points = pd.DataFrame(lod_points[layer["key"]], columns=["lat", "lon", "status", "feature"])
+            write_lod_chunks(points, os.path.join(tiles_folder, layer["key"]),
+                             min_zoom=layer.get("zoom", lod_min_zoom), detail_zoom=layer.get("zoom", lod_detail_zoom))
+        codes = {
+            feature[2]: feature[:2]
+            for key in ("db", "pijak") for lat, lon, _, feature in lod_points[key]
+            if np.isfinite(lat) and np.isfinite(lon)
+        }
+        with open(os.path.join(tiles_folder, "codes.json"), "w", encoding="utf-8") as f:
+            json.dump(codes, f, separators=(",", ":"))
+        m.get_root().html.add_child(Element(
+            Template(viewport_loader_template).render(layers=json.dumps(layers), folder=site["tiles_folder"])
+        ))
+
+        print("🧩 Viewport loading added to map.")
+
+    # Add toggle controls
+    m.get_root().html.add_child(folium.Element(toggle_controls_html))
+
+    print("⚙️ 31. Toggle controls added to map.")
+
+    # Add toggle controls script
+    m.get_root().html.add_child(folium.Element(toggle_controls_script))
+
+    print("⚙️ 32. Toggle controls script added to map.")
+
+    # Add responsive CSS
+    m.get_root().html.add_child(Element(responsive_css))
+
+    print("📱 33. Responsive CSS added to map.")
+
+    # Add legend
+    legend = MacroElement()
+    legend._template = Template(legend_template)
+    m.get_root().add_child(legend)
+
+    print("📋 34. Legend added to map.")
+
+    # Save map
+    map_path = site_path(site, "output_map")
+    m.save(map_path)
+    with open(map_path, "r", encoding="utf-8") as f:
+        html = f.read()
+    html = re.sub(r'^\s*window\.map\s*=\s*element_[a-f0-9]+;\s*$', '', html, flags=re.MULTILINE)
+    if not html.lstrip().lower().startswith("<!doctype html>"):
+        html = "<!DOCTYPE html>\n" + html
+
+    print(f"💾 35. Map saved to {map_path}.")
+
+def feature_table(df, columns, photos=None, source=None):
+    """Vectorized table of the GeoJSON features exported for `df`, one row per feature.
+
+    `columns` maps the exported property names (plus longitude and latitude) to the columns
+    of `df`. Features are keyed by code, prefixed with the source when a file mixes sources.
+    """
+    table = pd.DataFrame({name: df[column].to_numpy() for name, column in columns.items()})
+    table["code"] = table["code"].astype(str)
+    table["longitude"] = table["longitude"].astype("float64")
+    table["latitude"] = table["latitude"].astype("float64")
+    if source is not None:
+        table["source"] = source
+    table["ndvi"] = df["ndvi"].astype("float64").round(3).to_numpy() if "ndvi" in df.columns else np.nan
+    table["photos"] = table["code"].map(photos or {}).map(lambda files: files if isinstance(files, list) else [])
+    key = table["code"] if source is None else source + ":" + table["code"]
+    # Repeated codes keep their rows; later occurrences get a numbered key so every feature has its own
+    occurrence = key.groupby(key).cumcount()
+    table["key"] = key.where(occurrence == 0, key + "#" + (occurrence + 1).astype(str))
+    return table
+
+def combined_feature_table(df_latest, df_pijak, db_photos=None, pijak_photos=None):
+    db = feature_table(df_latest, {"tree_id": "tree_id", "tree_name": "tree_name", "code": "code", "status": "status",
+                                   "longitude": "longitude", "latitude": "latitude"}, db_photos, "DB")
+    pijak = feature_table(df_pijak, {"tree_name": "Nama pohon", "code": "Kode", "status": "Tree Status",
+                                     "longitude": "Longitude", "latitude": "Latitude"}, pijak_photos, "PIJAK")
+    table = pd.concat([db, pijak], ignore_index=True)
+    table["tree_id"] = pd.to_numeric(table["tree_id"], errors="coerce").astype("Int64")
+    return table
+
+def pijak_feature_table(df_pijak, pijak_photos=None):
+    return feature_table(df_pijak, {"tree_name": "Nama pohon", "code": "Kode", "status": "Tree Status",
+                                    "longitude": "Longitude", "latitude": "Latitude"}, pijak_photos)
+
+def table_features(table):
+    """GeoJSON features of the rows of a feature table, with the row key as feature id.
+
+    `tree_id` is left out of features that have none, the PIJAK rows of the combined table.
+    """
+    properties = table.drop(columns=["key", "longitude", "latitude"]).astype(object)
+    properties = properties.where(properties.notna(), None)
+    return [{
+        "type": "Feature",
+        "id": key,
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {name: value for name, value in props.items() if name != "tree_id" or value is not None}
+    } for key, lon, lat, props in zip(table["key"].tolist(), table["longitude"].tolist(),
+                                      table["latitude"].tolist(), properties.to_dict("records"))]
+
+def export_delta(table, path):
+    """Write the change set between the previous export of `path` and `table` next to it.
+
+    Rows are compared through a hash of their exported values, so one join finds the
+    added, removed and modified features. Returns the export version, which only moves
+    when something changed; clients that hold an older version reload the full file.
+    """
+    base = os.path.splitext(path)[0]
+    snapshot_path = f"{base}.snapshot.csv"
+    delta_path = f"{base}.delta.json"
+
+    hashed = table.drop(columns=["photos"]).assign(photos=table["photos"].map(";".join)).astype(str)
+    current = pd.DataFrame({"key": table["key"], "hash": pd.util.hash_pandas_object(hashed, index=False).astype(str).to_numpy()})
+
+    version = 0
+    if os.path.isfile(delta_path):
+        with open(delta_path, encoding="utf-8") as f:
+            version = json.load(f).get("version", 0)
+    if os.path.isfile(snapshot_path):
+        previous = pd.read_csv(snapshot_path, dtype=str, keep_default_na=False)
+    else:
+        previous = pd.DataFrame({"key": pd.Series(dtype=str), "hash": pd.Series(dtype=str)})
+
+    merged = current.merge(previous, on="key", how="outer", suffixes=("", "_previous"), indicator=True)
+    added = merged["_merge"] == "left_only"
+    removed = merged["_merge"] == "right_only"
+    modified = (merged["_merge"] == "both") & (merged["hash"] != merged["hash_previous"])
+    if version and not (added | removed | modified).any():
+        print(f"🧾 No changes since version {version} of {path}.")
+        return version
+
+    version += 1
+    rows = table.set_index("key", drop=False)
+    delta = {
+        "version": version,
+        "previous_version": version - 1,
+        "added": table_features(rows.loc[merged.loc[added, "key"]]),
+        "modified": table_features(rows.loc[merged.loc[modified, "key"]]),
+        "removed": merged.loc[removed, "key"].tolist()
+    }
+    with open(delta_path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, indent=2)
+    current.to_csv(snapshot_path, index=False)
+
+    print(f"🧾 Version {version} of {path}: {int(added.sum())} added, {int(modified.sum())} modified, "
+          f"{int(removed.sum())} removed, saved to {delta_path}.")
+    return version
+
+def export_geojson_combined(table, path=output_geojson, version=None):
+    # Export GeoJSON Combined
+    geojson = {
+        "type": "FeatureCollection",
+        "features": table_features(table)
+    }
+    if version is not None:
+        geojson["version"] = version
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, indent=2)
+
+    print(f"📁 36. GeoJSON combined saved to {path}.")
+
+def export_geojson_pijak(table, path=output_geojson_pijak, version=None):
+    # Export GeoJSON Pijak Only
+    geojson_pijak = {
+        "type": "FeatureCollection",
+        "features": table_features(table)
+    }
+    if version is not None:
+        geojson_pijak["version"] = version
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(geojson_pijak, f, indent=2)
+
+    print(f"📁 37. GeoJSON Pijak only saved to {path}.")
+
+def export_kml_combined(df_latest, df_pijak, path=output_kml):
+    # Export KML Combined
+    kml = simplekml.Kml()
+    for _, row in df_latest.iterrows():
+        kml.newpoint(name=str(row["code"]), description=f"[DB] {row['tree_name']}", coords=[(row["longitude"], row["latitude"])])
+    for _, row in df_pijak.iterrows():
+        kml.newpoint(name=str(row["Kode"]), description=f"[PIJAK] {row['Nama pohon']}", coords=[(row["Longitude"], row["Latitude"])])
+    kml.save(path)
+
+    print(f"📁 38. KML combined saved to {path}.")
+
+def export_kml_pijak(df_pijak, path=output_kml_pijak):
+    # Export KML Pijak Only
+    kml_pijak = simplekml.Kml()
+    for _, row in df_pijak.iterrows():
+        kml_pijak.newpoint(name=str(row["Kode"]), description=row["Nama pohon"], coords=[(row["Longitude"], row["Latitude"])])
+    kml_pijak.save(path)
+
+    print(f"📁 39. KML Pijak only saved to {path}.")
+
+def spatial_order(lats, lons, zoom=export_sort_zoom):
+    """Vectorized Z-order of points on the tile grid at `zoom`, points without coordinates last."""
+    x, y = tile_xy(lats, lons, zoom)
+    key = np.zeros(len(x), dtype=np.uint64)
+    for bit in range(zoom):
+        key |= (((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)).astype(np.uint64)
+    key[~(np.isfinite(lats) & np.isfinite(lons))] = np.iinfo(np.uint64).max
+    return np.argsort(key, kind="stable")
+
+def export_geoparquet(df, lat_col, lon_col, path, row_group_size=export_row_group_size):
+    """GeoParquet 1.1 export of every column of `df`, with WKB points and a bbox covering column.
+
+    Rows are sorted along a Z-order curve, so each row group covers a small area and its
+    bbox column statistics let readers skip the row groups outside a bounding box.
+    """
+    if pa is None:
+        print(f"⚠️ pyarrow is not installed, {path} skipped.")
+        return
+    df = df.iloc[spatial_order(df[lat_col].to_numpy(), df[lon_col].to_numpy())].reset_index(drop=True)
+    lats = df[lat_col].to_numpy(dtype="float64")
+    lons = df[lon_col].to_numpy(dtype="float64")
+    valid = pa.array(np.isfinite(lats) & np.isfinite(lons))
+
+    # Little-endian WKB points, built as one fixed size buffer
+    wkb = np.zeros(len(df), dtype=[("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+    wkb["order"], wkb["type"], wkb["x"], wkb["y"] = 1, 1, lons, lats
+    geometry = pa.FixedSizeBinaryArray.from_buffers(pa.binary(wkb.dtype.itemsize), len(df),
+                                                    [None, pa.py_buffer(wkb.tobytes())]).cast(pa.binary())
+    geometry = pc.if_else(valid, geometry, pa.nulls(len(df), pa.binary()))
+    bbox = pa.StructArray.from_arrays([pa.array(lons), pa.array(lats), pa.array(lons), pa.array(lats)],
+                                      names=["xmin", "ymin", "xmax", "ymax"], mask=pc.invert(valid))
+
+    attributes = df.astype({column: "string" for column in df.columns if df[column].dtype == object})
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    table = table.append_column("bbox", bbox).append_column("geometry", geometry)
+    finite = np.isfinite(lats) & np.isfinite(lons)
+    geo = {
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {
+            "geometry": {
+                "encoding": "WKB",
+                "geometry_types": ["Point"],
+                "bbox": [float(lons[finite].min()), float(lats[finite].min()),
+                         float(lons[finite].max()), float(lats[finite].max())] if finite.any() else [],
+                "covering": {"bbox": {name: ["bbox", name] for name in ("xmin", "ymin", "xmax", "ymax")}}
+            }
+        }
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(geo).encode()})
+    pq.write_table(table, path, row_group_size=row_group_size, compression="zstd")
+
+    print(f"📦 GeoParquet saved to {path} ({table.num_rows} rows, {-(-table.num_rows // row_group_size)} row groups).")
+
+def export_flatgeobuf(df, lat_col, lon_col, path):
+    """FlatGeobuf export of every column of `df`, with its packed Hilbert R-tree index."""
+    if gpd is None:
+        print(f"⚠️ geopandas is not installed, {path} skipped.")
+        return
+    # The R-tree needs a bounding box for every feature
+    df = df[np.isfinite(df[lat_col]) & np.isfinite(df[lon_col])]
+    attributes = df.astype({column: object for column in df.columns
+                            if isinstance(df[column].dtype, (pd.CategoricalDtype, pd.StringDtype))})
+    gdf = gpd.GeoDataFrame(attributes, geometry=gpd.points_from_xy(df[lon_col], df[lat_col]), crs="EPSG:4326")
+    gdf.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+
+    print(f"📦 FlatGeobuf saved to {path} ({len(gdf)} features).")
+
+# Stage scheduler
+class StageError(RuntimeError):
+    pass
+
+class StageScheduler:
+    """Run stages on a thread pool, each one as soon as the stages it depends on are done.
+
+    A stage receives the results of its dependencies as arguments. When a stage fails
+    or runs longer than its timeout, the stages not started yet are cancelled and
+    `cancelled` is set so that running stages can stop early. An optional stage that
+    fails or times out only sets `cancelled`, its result is None and the build goes on.
+    """
+
+    def __init__(self, max_workers=stage_workers, timeout=stage_timeout_seconds):
+        self.stages = {}
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def add(self, name, func, deps=(), timeout=None, optional=False):
+        # Dependencies have to be added first, which keeps the graph acyclic
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages {unknown}")
+        self.stages[name] = (func, tuple(deps), timeout or self.timeout, optional)
+
+    def run(self):
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def fail(name, message, error=None):
+            if not self.stages[name][3]:
+                raise StageError(message) from error
+            print(f"⚠️ {message}, continuing without it.")
+            self.cancelled.set()
+            results[name] = None
 
-print(f"📁 39. KML Pijak only saved to {output_kml_pijak}.")
+        try:
+            while pending or running:
+                for name, (func, deps, timeout, _) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        del pending[name]
+                        started = time.monotonic()
+                        future = pool.submit(func, *[results[dep] for dep in deps])
+                        running[future] = (name, started, started + timeout)
+                next_deadline = min(deadline for _, _, deadline in running.values())
+                done, _ = wait(running, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, started, _ = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        fail(name, f"Stage {name} failed: {e}", e)
+                        continue
+                    print(f"⏱️ Stage {name} done in {time.monotonic() - started:.1f}s.")
+                now = time.monotonic()
+                for future, (name, started, deadline) in list(running.items()):
+                    if now >= deadline:
+                        del running[future]
+                        fail(name, f"Stage {name} timed out after {now - started:.1f}s")
+        except BaseException:
+            self.cancelled.set()
+            raise
+        finally:
+            # Threads of timed out stages cannot be killed, do not wait for them
+            pool.shutdown(wait=not self.cancelled.is_set(), cancel_futures=True)
+        return results
+
+# Shared clients and caches
+def snapshot_folder(folder):
+    if not os.path.isdir(folder):
+        return {}
+    return {entry.path: (entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in os.scandir(folder) if entry.is_file()}
+
+class SharedClients:
+    """Sheets client, Earth Engine session and caches shared by every site built in a process.
+
+    The Earth Engine client is not thread-safe, concurrent builds take turns through `ee_lock`.
+    """
+
+    def __init__(self, ee_module=ee):
+        self.gc = None
+        # Earth Engine client, replaceable by a local fake exposing the same calls
+        self.ee = ee_module
+        self.ee_project = None
+        # (point, dates) -> Sentinel-2 composite
+        self.sentinels = {}
+        # (project, point, dates) -> (time, tile URLs)
+        self.ee_tiles = {}
+        # pictures folder -> (folder snapshot, image points), the folder is only scanned again when it
+        # changes and the photo store reads EXIF once per distinct image
+        self.image_points = {}
+        self.sheets_lock = threading.Lock()
+        # Reentrant, get_tiles and get_ndvi go through get_sentinel and use_ee_project
+        self.ee_lock = threading.RLock()
+
+    def sheets(self):
+        with self.sheets_lock:
+            if self.gc is None:
+                self.gc = init_sheets_client()
+        return self.gc
+
+    def use_ee_project(self, project):
+        with self.ee_lock:
+            if project != self.ee_project:
+                init_earth_engine(project, self.ee)
+                self.ee_project = project
+
+    def get_sentinel(self, site):
+        with self.ee_lock:
+            self.use_ee_project(site["ee_project"])
+            point, dates = tuple(site["sentinel_point"]), tuple(site["sentinel_dates"])
+            if (point, dates) not in self.sentinels:
+                self.sentinels[(point, dates)] = get_sentinel_image(point, dates, self.ee)
+            return self.sentinels[(point, dates)]
+
+    def get_tiles(self, site):
+        key = (site["ee_project"], tuple(site["sentinel_point"]), tuple(site["sentinel_dates"]))
+        with self.ee_lock:
+            cached = self.ee_tiles.get(key)
+            if cached is None or time.monotonic() - cached[0] > ee_tiles_max_age_seconds:
+                cached = (time.monotonic(), get_ee_tiles(self.get_sentinel(site), self.ee))
+                self.ee_tiles[key] = cached
+            return cached[1]
+
+    def get_ndvi(self, site, codes, lats, lons, cache):
+        """NDVI at each tree, only the trees missing from `cache` are sampled."""
+        params = json.dumps(["COPERNICUS/S2_HARMONIZED", site["sentinel_point"], site["sentinel_dates"], "B8-B4", ndvi_scale])
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        keys = [f"{params}|{code}|{lat:.7f}|{lon:.7f}" for code, lat, lon in zip(codes, lats, lons)]
+        missing = [i for i, key in enumerate(keys) if key not in cache and np.isfinite(lats[i]) and np.isfinite(lons[i])]
+        if missing:
+            with self.ee_lock:
+                image = get_ndvi_image(self.get_sentinel(site))
+                values = sample_image(image, lats[missing], lons[missing], self.ee)
+            for i, value in zip(missing, values):
+                cache[keys[i]] = value
+            print(f"🌿 NDVI sampled for {len(missing)} trees, {len(keys) - len(missing)} from cache.")
+        return [cache.get(key) for key in keys]
+
+    def get_image_points(self, store):
+        snapshot = snapshot_folder(store.folder)
+        cached = self.image_points.get(store.folder)
+        if cached is None or cached[0] != snapshot:
+            cached = (snapshot, store.image_points())
+            self.image_points[store.folder] = cached
+        return cached[1]
+
+# Build session
+class BuildSession:
+    """Keeps the loaded data of one site warm between builds."""
+
+    def __init__(self, site=DEFAULT_SITE, clients=None):
+        self.site = site
+        self.clients = clients or SharedClients()
+        # db_path -> (mtime, DataFrame) so unchanged .db files are not queried again
+        self.db_cache = {}
+        self.df_db = None
+        self.df_latest = None
+        self.status_values = None
+        self.df_status = None
+        self.pijak_records = None
+        self.df_pijak = None
+        self.image_points = None
+        self.db_photos = None
+        self.pijak_photos = None
+        self.df_reconciliation = None
+        self.ndvi_cache = None
+        self.db_ndvi = None
+        self.pijak_ndvi = None
+        self.pictures_store = photo_store(site, "pictures_folder", "pictures_index")
+        self.pijak_store = photo_store(site, "pijak_pictures_folder", "pijak_pictures_index")
+
+    def output(self, key):
+        return site_path(self.site, key)
+
+    def load_db(self):
+        # Process each .db file
+        db_paths = glob(os.path.join(self.output("db_folder"), "*.db"))
+        if not db_paths:
+            print("❌ No .db files found.")
+            return None
+
+        frames = []
+        for idx, db_path in enumerate(db_paths, start=1):
+            mtime = os.path.getmtime(db_path)
+            cached = self.db_cache.get(db_path)
+            if cached and cached[0] == mtime:
+                frames.append(cached[1])
+                continue
+            try:
+                out_csv = process_db_file(db_path, self.site["root"])
+                df = apply_schema(pd.read_csv(out_csv), DB_SCHEMA)
+                self.db_cache[db_path] = (mtime, df)
+                frames.append(df)
+                print(f"📁 {idx}. Processed {db_path} and saved to {out_csv}.")
+            except Exception as e:
+                print(f"❌ Error with {db_path}: {e}")
+        for db_path in set(self.db_cache) - set(db_paths):
+            del self.db_cache[db_path]
+
+        if not frames:
+            print("⚠️ No CSVs generated.")
+            return None
+        return aggregate_db(frames)
+
+    def refresh_db(self):
+        df_db = self.load_db()
+        if df_db is None:
+            return False
+        self.df_db = df_db
+        return True
+
+    def sample_ndvi(self):
+        cache_path = self.output("ndvi_cache")
+        if self.ndvi_cache is None:
+            self.ndvi_cache = {}
+            if os.path.isfile(cache_path):
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    self.ndvi_cache = json.load(f)
+        db_ndvi, pijak_ndvi = {}, {}
+        try:
+            if self.df_db is not None:
+                values = self.clients.get_ndvi(self.site, self.df_db["code"], self.df_db["latitude"],
+                                               self.df_db["longitude"], self.ndvi_cache)
+                db_ndvi = dict(zip(self.df_db["code"], values))
+            values = self.clients.get_ndvi(self.site, self.df_pijak["Kode"], self.df_pijak["Latitude"],
+                                           self.df_pijak["Longitude"], self.ndvi_cache)
+            pijak_ndvi = dict(zip(self.df_pijak["Kode"], values))
+        except Exception as e:
+            print(f"❌ NDVI sampling failed: {e}")
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(self.ndvi_cache, f)
+        self.db_ndvi, self.pijak_ndvi = db_ndvi, pijak_ndvi
+
+    def poll_status(self):
+        values = fetch_tree_status_values(self.clients.sheets(), self.site["sheet_name"], self.site["worksheet_name"])
+        if values == self.status_values:
+            return set()
+        self.status_values = values
+        self.df_status = load_tree_status(values)
+        return {"status"}
+
+    def poll_pijak(self):
+        records = fetch_pijak_records(self.clients.sheets(), self.site["sheet_name"])
+        if records == self.pijak_records:
+            return set()
+        self.pijak_records = records
+        self.df_pijak = load_pijak(records)
+        return {"pijak"}
+
+    def poll_sheets(self):
+        """Fetch both sheets concurrently and return the sources whose content changed."""
+        stages = StageScheduler()
+        stages.add("status", self.poll_status)
+        stages.add("pijak", self.poll_pijak)
+        return set().union(*stages.run().values())
+
+    def rebuild(self, dirty):
+        """Refresh the dirty sources and regenerate only the outputs depending on them."""
+        outputs = {name for name, deps in OUTPUT_DEPENDENCIES.items() if deps & dirty}
+        # Independent network and disk stages run concurrently
+        stages = StageScheduler()
+        if self.status_values is None:
+            stages.add("status", self.poll_status)
+        if self.pijak_records is None:
+            stages.add("pijak", self.poll_pijak)
+        if "db" in dirty or self.df_db is None:
+            stages.add("db", self.refresh_db)
+        if "pictures" in dirty or self.image_points is None:
+            stages.add("pictures", lambda: self.clients.get_image_points(self.pictures_store))
+        if "map" in outputs:
+            # Earth Engine calls stay in a single stage, its client is not thread-safe
+            stages.add("ee_tiles", lambda: self.clients.get_tiles(self.site))
+            stages.add("downloads", lambda *_: download_pijak_photos(self.df_pijak, self.site, stages.cancelled,
+                                                                 self.pijak_store),
+                       deps=["pijak"] if "pijak" in stages else [], optional=True)
+        if dirty & {"db", "pijak"} or self.db_ndvi is None:
+            # After ee_tiles, the Earth Engine client is not thread-safe
+            stages.add("ndvi", lambda *_: self.sample_ndvi(),
+                       deps=[name for name in ("db", "pijak", "ee_tiles") if name in stages])
+        results = stages.run()
+
+        if results.get("db") is False:
+            return False
+        if "pictures" in results:
+            self.image_points = results["pictures"]
+        if dirty & {"db", "status"} or self.df_latest is None or "ndvi" in results:
+            self.df_latest = merge_status(self.df_db, self.df_status)
+            self.df_latest["ndvi"] = self.df_latest["code"].map(self.db_ndvi).astype("float32")
+        if "ndvi" in results or "ndvi" not in self.df_pijak:
+            self.df_pijak = self.df_pijak.assign(ndvi=self.df_pijak["Kode"].map(self.pijak_ndvi).astype("float32"))
+        if dirty & {"db", "pictures"} or self.db_photos is None:
+            self.db_photos = attach_photos_to_trees(
+                self.image_points, self.df_latest["code"].values,
+                self.df_latest["latitude"].values, self.df_latest["longitude"].values
+            )
+        if dirty & {"pijak", "pictures"} or self.pijak_photos is None:
+            self.pijak_photos = attach_photos_to_trees(
+                self.image_points, self.df_pijak["Kode"].values,
+                self.df_pijak["Latitude"].values, self.df_pijak["Longitude"].values
+            )
+        if dirty & {"db", "status", "pijak"} or self.df_reconciliation is None:
+            self.df_reconciliation = reconcile(self.df_latest, self.df_pijak)
+
+        if "csv" in outputs:
+            self.df_latest.to_csv(self.output("output_csv"), index=False)
+            print("🔗 13. Status data merged and saved to CSV.")
+            export_geoparquet(self.df_latest, "latitude", "longitude", self.output("output_parquet"))
+            export_flatgeobuf(self.df_latest, "latitude", "longitude", self.output("output_fgb"))
+        if "map" in outputs:
+            build_map(self.df_latest, self.df_pijak, self.image_points, results["ee_tiles"],
+                      self.db_photos, self.pijak_photos, self.df_reconciliation, self.site, self.pijak_store)
+        if "combined" in outputs:
+            table = combined_feature_table(self.df_latest, self.df_pijak, self.db_photos, self.pijak_photos)
+            version = export_delta(table, self.output("output_geojson"))
+            export_geojson_combined(table, self.output("output_geojson"), version)
+            export_kml_combined(self.df_latest, self.df_pijak, self.output("output_kml"))
+        if "reconciliation" in outputs:
+            self.df_reconciliation.to_csv(self.output("output_reconciliation"), index=False)
+            print(f"🧮 Reconciliation report saved to {self.output('output_reconciliation')}.")
+        if "pijak" in outputs:
+            table = pijak_feature_table(self.df_pijak, self.pijak_photos)
+            version = export_delta(table, self.output("output_geojson_pijak"))
+            export_geojson_pijak(table, self.output("output_geojson_pijak"), version)
+            export_kml_pijak(self.df_pijak, self.output("output_kml_pijak"))
+            export_geoparquet(self.df_pijak, "Latitude", "Longitude", self.output("output_parquet_pijak"))
+            export_flatgeobuf(self.df_pijak, "Latitude", "Longitude", self.output("output_fgb_pijak"))
+
+        print(f"✅ 40. Map and exports generated for {self.site['name']}.")
+        return True
+
+# Watch mode
+class SourceEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher, source):
+        super().__init__()
+        self.watcher = watcher
+        self.source = source
+
+    def on_any_event(self, event):
+        # Rebuilds read their inputs, opened and closed events would trigger another rebuild
+        if not event.is_directory and event.event_type in ("created", "modified", "deleted", "moved"):
+            self.watcher.mark(self.source)
+
+class SourceWatcher:
+    """Collects file changes in the watched folders, using inotify through watchdog when installed and polling otherwise."""
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.pending = set()
+        self.last_event = 0.0
+        self.lock = threading.Lock()
+        self.observer = None
+        self.snapshots = {}
+
+    def start(self):
+        if Observer is not None:
+            self.observer = Observer()
+            for source, folder in self.folders.items():
+                if os.path.isdir(folder):
+                    self.observer.schedule(SourceEventHandler(self, source), folder, recursive=False)
+            self.observer.start()
+            print("👀 Watching folders with inotify.")
+        else:
+            self.snapshots = {source: snapshot_folder(folder) for source, folder in self.folders.items()}
+            print("👀 Watching folders by polling (install watchdog for inotify).")
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def mark(self, source):
+        with self.lock:
+            self.pending.add(source)
+            self.last_event = time.monotonic()
+
+    def poll(self):
+        if self.observer is not None:
+            return
+        for source, folder in self.folders.items():
+            snapshot = snapshot_folder(folder)
+            if snapshot != self.snapshots[source]:
+                self.snapshots[source] = snapshot
+                self.mark(source)
+
+    def take(self, debounce):
+        """Return the pending sources once no new event arrived for `debounce` seconds."""
+        with self.lock:
+            if not self.pending or time.monotonic() - self.last_event < debounce:
+                return set()
+            pending, self.pending = self.pending, set()
+            return pending
+
+def watch(session, debounce=watch_debounce_seconds, sheet_interval=sheet_poll_seconds):
+    watcher = SourceWatcher({
+        "db": session.output("db_folder"),
+        "pictures": session.output("pictures_folder"),
+        "pijak_foto": session.output("pijak_pictures_folder"),
+    })
+    watcher.start()
+    # Sources of a failed rebuild, rebuilt again with the next changes or after watch_retry_seconds
+    failed = set()
+    next_retry = 0.0
+    try:
+        session.rebuild(set(SOURCES))
+    except Exception as e:
+        print(f"❌ Rebuild failed: {e}")
+        failed = set(SOURCES)
+        next_retry = time.monotonic() + watch_retry_seconds
+    next_sheet_poll = time.monotonic() + sheet_interval
+    try:
+        while True:
+            time.sleep(watch_tick_seconds)
+            watcher.poll()
+            dirty = watcher.take(debounce)
+            now = time.monotonic()
+            if failed and now >= next_retry:
+                dirty |= failed
+            polled = now >= next_sheet_poll
+            try:
+                if polled:
+                    # Moved first, a failing Sheets API is polled again after sheet_interval too
+                    next_sheet_poll = now + sheet_interval
+                    dirty |= session.poll_sheets()
+                if dirty:
+                    print(f"🔄 Changes detected in {', '.join(sorted(dirty))}, rebuilding...")
+                    session.rebuild(dirty | failed)
+                    failed = set()
+            except Exception as e:
+                print(f"❌ Rebuild failed: {e}")
+                # A failed poll may already hold the new values of one sheet, its outputs are rebuilt on retry
+                failed |= dirty | ({"status", "pijak"} if polled else set())
+                next_retry = time.monotonic() + watch_retry_seconds
+    except KeyboardInterrupt:
+        print("👋 Watch mode stopped.")
+    finally:
+        watcher.stop()
+
+# Query API
+class TreeStore:
+    """In-memory copy of the combined GeoJSON export with a grid index, and code, status and source hash indexes.
+
+    The export is read again when its file changes, e.g. after a rebuild in watch mode.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.dataset = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            try:
+                dataset = self.load()
+            except ValueError as e:
+                # Usually an export being written, the next request tries again
+                print(f"⚠️ Query API could not read {self.path}, keeping the previous data: {e}")
+                return
+            # Swapped at once, requests in flight keep the previous dataset
+            self.dataset, self.mtime = dataset, mtime
+        print(f"🛰️ Query API loaded {len(dataset['features'])} trees from {self.path}.")
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        geojson = json.loads(data)
+        features = geojson["features"]
+        coords = np.array([feature["geometry"]["coordinates"] for feature in features], dtype=float).reshape(-1, 2)
+        properties = pd.DataFrame([feature["properties"] for feature in features],
+                                  columns=["code", "status", "source"], index=pd.RangeIndex(len(features)))
+        return {
+            "features": features,
+            "version": geojson.get("version"),
+            "etag": hashlib.sha1(data).hexdigest()[:16],
+            "grid": GridIndex(coords[:, 1], coords[:, 0], serve_nearest_max_m),
+            "by_code": properties.groupby(properties["code"].astype(str)).indices,
+            "by_status": properties.groupby(properties["status"].fillna("").astype(str)).indices,
+            "by_source": properties.groupby(properties["source"].fillna("").astype(str)).indices,
+        }
 
-print("✅ 40. Map and exports generated.")
+def query_ids(index, values):
+    """Sorted feature indexes matching any of `values` in a hash index."""
+    found = [index[value] for value in set(values) if value in index]
+    if len(found) == 1:
+        return found[0]
+    return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+def query_trees(dataset, params):
+    """Feature indexes for the /trees filters: bbox=minLon,minLat,maxLon,maxLat, status=a,b and source=DB|PIJAK."""
+    ids = None
+    if "bbox" in params:
+        try:
+            min_lon, min_lat, max_lon, max_lat = map(float, params["bbox"].split(","))
+        except ValueError:
+            raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+        if not np.isfinite([min_lon, min_lat, max_lon, max_lat]).all():
+            raise ValueError("bbox values must be finite numbers")
+        ids = dataset["grid"].within_bbox(min_lat, min_lon, max_lat, max_lon)
+    for name, index in (("status", "by_status"), ("source", "by_source")):
+        if name in params:
+            matched = query_ids(dataset[index], params[name].split(","))
+            ids = matched if ids is None else np.intersect1d(ids, matched, assume_unique=True)
+    return np.arange(len(dataset["features"])) if ids is None else ids
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Read-only JSON endpoints over a TreeStore.
+
+    GET /                          dataset summary
+    GET /trees?bbox=&status=&source=&offset=&limit=
+    GET /trees/nearest?lat=&lon=&max_m=
+    GET /trees/<code>
+    """
+    store = None
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        self.store.refresh()
+        dataset = self.store.dataset
+        if dataset is None:
+            status, body = 503, {"error": f"{self.store.path} has not been exported yet"}
+        else:
+            try:
+                status, body = self.route(dataset, url.path.rstrip("/") or "/", params)
+            except ValueError as e:
+                status, body = 400, {"error": str(e)}
+        etag = f'"{dataset["etag"]}-{hashlib.sha1(self.path.encode()).hexdigest()[:8]}"' if dataset else None
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.send_header("Server-Timing", f"query;dur={(time.perf_counter() - started) * 1000:.3f}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def route(self, dataset, path, params):
+        features = dataset["features"]
+        if path == "/":
+            return 200, {"trees": len(features), "version": dataset["version"], "etag": dataset["etag"]}
+        if path == "/trees":
+            ids = query_trees(dataset, params)
+            offset = int(params.get("offset", 0))
+            limit = min(int(params.get("limit", serve_page_size)), serve_max_page_size)
+            if offset < 0 or limit < 1:
+                raise ValueError("offset must be >= 0 and limit >= 1")
+            page = ids[offset:offset + limit]
+            return 200, {
+                "type": "FeatureCollection",
+                "features": [features[i] for i in page],
+                "total": len(ids),
+                "offset": offset,
+                "limit": limit,
+                "next_offset": offset + limit if offset + limit < len(ids) else None,
+            }
+        if path == "/trees/nearest":
+            if "lat" not in params or "lon" not in params:
+                raise ValueError("lat and lon are required")
+            lat, lon = float(params["lat"]), float(params["lon"])
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise ValueError("lat must be within [-90, 90] and lon within [-180, 180]")
+            max_m = float(params.get("max_m", serve_nearest_max_m))
+            if not max_m >= 0:
+                raise ValueError("max_m must be >= 0")
+            max_m = min(max_m, serve_nearest_max_m)
+            index, distance = dataset["grid"].nearest([lat], [lon], max_m)
+            if index[0] < 0:
+                return 404, {"error": f"no tree within {max_m:g} m"}
+            return 200, {**features[index[0]], "distance_m": round(float(distance[0]), 2)}
+        if path.startswith("/trees/"):
+            code = unquote(path[len("/trees/"):])
+            if code not in dataset["by_code"]:
+                return 404, {"error": f"unknown code {code}"}
+            return 200, {"type": "FeatureCollection", "features": [features[i] for i in dataset["by_code"][code]]}
+        return 404, {"error": f"unknown path {path}"}
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(site, host=serve_host, port=serve_port):
+    """Serve the site's combined GeoJSON export read-only until interrupted."""
+    handler = type("SiteQueryHandler", (QueryHandler,), {"store": TreeStore(site_path(site, "output_geojson"))})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"🛰️ Query API listening on http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("👋 Query API stopped.")
+    finally:
+        server.server_close()
+
+# Batch builds
+def build_site(site, clients):
+    print(f"🏗️ Building site {site['name']}...")
+    return BuildSession(site, clients).rebuild(set(SOURCES))
+
+def build_sites(sites, jobs=None, clients=None):
+    """Build the sites concurrently with shared clients, return the names of the sites that failed."""
+    jobs = jobs or min(len(sites), site_workers)
+    clients = clients or SharedClients()
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(build_site, site, clients): site["name"] for site in sites}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"❌ Site {name} failed: {e}")
+                ok = False
+            if ok:
+                print(f"✅ Site {name} built.")
+            else:
+                failed.append(name)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the mangrove tree map and exports.")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and rebuild the affected outputs when the db, pictures or sheets change")
+    parser.add_argument("--debounce", type=float, default=watch_debounce_seconds,
+                        help="seconds without file events before a rebuild starts")
+    parser.add_argument("--sheet-interval", type=float, default=sheet_poll_seconds,
+                        help="seconds between two Google Sheets polls in watch mode")
+    parser.add_argument("--sites", metavar="PATH",
+                        help="JSON site configuration, builds every site unless --site is given")
+    parser.add_argument("--site", metavar="NAME", help="only build this site of the --sites configuration")
+    parser.add_argument("--jobs", type=int, help=f"number of sites built concurrently (default {site_workers})")
+    parser.add_argument("--serve", action="store_true",
+                        help="serve the exported trees as a read-only JSON query API, alongside --watch if given")
+    parser.add_argument("--host", default=serve_host, help="query API address")
+    parser.add_argument("--port", type=int, default=serve_port, help="query API port")
+    args = parser.parse_args()
+
+    sites = load_sites(args.sites) if args.sites else [DEFAULT_SITE]
+    if args.site:
+        sites = [site for site in sites if site["name"] == args.site]
+        if not sites:
+            parser.error(f"unknown site {args.site}")
+    if args.watch and len(sites) > 1:
+        parser.error("--watch builds a single site, select it with --site")
+    if args.serve and len(sites) > 1:
+        parser.error("--serve serves a single site, select it with --site")
+
+    if len(sites) > 1:
+        failed = build_sites(sites, args.jobs)
+        if failed:
+            print(f"❌ Failed sites: {', '.join(failed)}")
+            exit(1)
+        return
+
+    if args.serve and not args.watch:
+        serve(sites[0], args.host, args.port)
+        return
+    if args.serve:
+        threading.Thread(target=serve, args=(sites[0], args.host, args.port), daemon=True).start()
+
+    session = BuildSession(sites[0])
+    if args.watch:
+        watch(session, debounce=args.debounce, sheet_interval=args.sheet_interval)
+    elif not session.rebuild(set(SOURCES)):
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Local stand-in for the Earth Engine calls made by pijak.py, passed as `ee_module`.
+
+Every sampled point gets a value computed from its longitude, and reduceRegions
+returns the features in reverse order, so the mapping back through the "i"
+property is exercised.
+"""
+import types
+
+
+class FakeEE:
+    def __init__(self):
+        self.calls = {"Initialize": 0, "reduceRegions": 0, "batch_sizes": []}
+        fake = self
+
+        class Chain:
+            """Any method call returns the object itself, enough for the image recipes."""
+
+            def __init__(self, *args, **kwargs):
+                self.args = args
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self
+
+        class Image(Chain):
+            def reduceRegions(self, collection, reducer, scale):
+                features = collection.args[0]
+                fake.calls["reduceRegions"] += 1
+                fake.calls["batch_sizes"].append(len(features))
+                sampled = [
+                    {"properties": {**feature.args[1], "value": fake.value(feature.args[0].args[0][0])}}
+                    for feature in reversed(features)
+                ]
+                return types.SimpleNamespace(getInfo=lambda: {"features": sampled})
+
+        class ImageCollection(Chain):
+            def median(self):
+                return Image()
+
+        self.Image = Image
+        self.ImageCollection = ImageCollection
+        self.Feature = Chain
+        self.FeatureCollection = Chain
+        self.Geometry = types.SimpleNamespace(Point=Chain)
+        self.Filter = types.SimpleNamespace(lt=Chain)
+        self.Reducer = types.SimpleNamespace(first=Chain)
+
+    @staticmethod
+    def value(lon):
+        return round(lon % 1, 6)
+
+    def Authenticate(self):
+        pass
+
+    def Initialize(self, project=None):
+        self.calls["Initialize"] += 1
@@ -0,0 +1,52 @@
+"""Checks the batched NDVI sampling against a fake Earth Engine.
+
+Run with `python -m pytest tests` or `python tests/test_ndvi_sampling.py`.
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pijak
+from fake_ee import FakeEE
+
+
+def points(n):
+    rng = np.random.default_rng(0)
+    return 1.18 + rng.random(n) * 0.01, 124.51 + rng.random(n) * 0.01
+
+
+def test_sample_image_batches_and_maps_values_back():
+    fake = FakeEE()
+    lats, lons = points(12001)
+    values = pijak.sample_image(fake.Image(), lats, lons, fake, batch_size=5000)
+    assert fake.calls["batch_sizes"] == [5000, 5000, 2001]
+    assert values == [FakeEE.value(lon) for lon in lons]
+
+
+def test_get_ndvi_only_samples_uncached_trees():
+    fake = FakeEE()
+    clients = pijak.SharedClients(ee_module=fake)
+    lats, lons = points(10)
+    codes = [f"JJK-{i:03d}" for i in range(10)]
+    lats[3] = np.nan
+    cache = {}
+    values = clients.get_ndvi(pijak.DEFAULT_SITE, codes, lats, lons, cache)
+    assert fake.calls["reduceRegions"] == 1
+    assert fake.calls["batch_sizes"] == [9]
+    assert values[3] is None
+    assert values[:3] == [FakeEE.value(lon) for lon in lons[:3]]
+
+    values_again = clients.get_ndvi(pijak.DEFAULT_SITE, codes, lats, lons, cache)
+    assert fake.calls["reduceRegions"] == 1
+    assert values_again == values
+    assert fake.calls["Initialize"] == 1
+
+
+if __name__ == "__main__":
+    test_sample_image_batches_and_maps_values_back()
+    test_get_ndvi_only_samples_uncached_trees()
+    print("✅ NDVI sampling checks passed.")